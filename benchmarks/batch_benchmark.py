@@ -0,0 +1,83 @@
+"""
+Compare payments per second through POST /payments and POST /payments/batch.
+
+Drives the ASGI app in-process over httpx, so the numbers cover routing,
+authentication, validation and storage but no network.
+
+    python benchmarks/batch_benchmark.py --payments 5000 --batch-size 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app  # noqa: E402
+
+PAYMENT = {
+    "credit_card": {
+        "card_number": "4111111111111111",
+        "expiry_month": 12,
+        "expiry_year": datetime.now().year + 2,
+        "cvv": "123",
+        "cardholder_name": "Bench User",
+    },
+    "amount": 42.5,
+    "description": "benchmark payment",
+}
+
+
+async def authenticate(client: httpx.AsyncClient) -> dict:
+    credentials = {"username": "batchbench", "password": "BenchPassw0rd"}
+    await client.post("/register", json={"email": "batchbench@example.com", **credentials})
+    response = await client.post("/token", data=credentials)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def single(client: httpx.AsyncClient, headers: dict, payments: int) -> float:
+    start = time.perf_counter()
+    for _ in range(payments):
+        response = await client.post("/payments", json=PAYMENT, headers=headers)
+        response.raise_for_status()
+    return payments / (time.perf_counter() - start)
+
+
+async def batched(client: httpx.AsyncClient, headers: dict, payments: int,
+                  batch_size: int) -> float:
+    start = time.perf_counter()
+    for offset in range(0, payments, batch_size):
+        batch = [PAYMENT] * min(batch_size, payments - offset)
+        response = await client.post("/payments/batch", json=batch, headers=headers)
+        response.raise_for_status()
+    return payments / (time.perf_counter() - start)
+
+
+async def run(payments: int, batch_size: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = await authenticate(client)
+        single_rate = await single(client, headers, payments)
+        batch_rate = await batched(client, headers, payments, batch_size)
+    print(f"{'endpoint':<24}{'payments/s':>14}")
+    print(f"{'POST /payments':<24}{single_rate:>14,.0f}")
+    print(f"{'POST /payments/batch':<24}{batch_rate:>14,.0f}")
+    print(f"speedup: {batch_rate / single_rate:.1f}x at batch size {batch_size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.payments, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Load and latency suite for the API's main endpoints.
+
+Each scenario is run at each concurrency level by a closed loop of workers
+that send requests back to back until the scenario's request count is
+reached. Two targets are supported:
+
+  asgi     the app in this process over httpx's ASGITransport (no network,
+           no server; startup/shutdown hooks are not run)
+  uvicorn  a local uvicorn subprocess over HTTP, started for the run
+
+Before the scenarios run, --users users are registered and logged in and
+each gets --payments-per-user payments, so token and list requests see a
+dataset of that size. The token scenario logs in as a second set of
+--users users, so the per-user token cap never evicts the tokens the
+payment scenarios use. Results are printed as RPS and p50/p95/p99 latency
+and can be written as JSON with --output. --compare reads an earlier
+--output file and reports the change for every matching result, exiting
+non-zero if RPS fell or p99 rose by more than --tolerance percent.
+
+    python benchmarks/load_suite.py --target asgi uvicorn --concurrency 1 16 64 \\
+        --requests 2000 --output results.json
+    python benchmarks/load_suite.py --compare results.json
+
+Registration and login hash passwords with scrypt, so those scenarios are
+bounded by PASSWORD_HASH_WORKERS; set SCRYPT_N lower to focus on the rest
+of the request path. Environment variables are passed on to the uvicorn
+subprocess. Auth admission control is turned off unless
+AUTH_ADMISSION_ENABLED is set, as every request comes from one client; a
+server given with --url needs it turned off too.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("AUTH_ADMISSION_ENABLED", "0")
+
+PASSWORD = "LoadPassw0rd"
+PAYMENT = {
+    "credit_card": {
+        "card_number": "4111111111111111",
+        "expiry_month": 12,
+        "expiry_year": datetime.now().year + 2,
+        "cvv": "123",
+        "cardholder_name": "Load User",
+    },
+    "amount": 42.5,
+    "description": "load test payment",
+}
+PRELOAD_BATCH_SIZE = 500
+DEMO_GENERATORS = [
+    "/demo/generate-user",
+    "/demo/generate-credit-card",
+    "/demo/generate-payment",
+    "/demo/generate-address",
+    "/demo/generate-profile",
+    "/demo/generate-product",
+    "/demo/generate-transaction",
+    "/demo/generate-review",
+    "/demo/generate-insecure-credit-card",
+]
+
+
+class Dataset:
+    """Users registered for the run, with their bearer tokens."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.usernames = []
+        self.headers = []
+        self.login_usernames = []
+        self._registered = itertools.count()
+
+    def next_username(self) -> str:
+        return f"load_{self.run_id}_{next(self._registered)}"
+
+    def auth(self, i: int) -> dict:
+        return self.headers[i % len(self.headers)]
+
+
+async def register(client: httpx.AsyncClient, dataset: Dataset, i: int) -> httpx.Response:
+    username = dataset.next_username()
+    return await client.post("/register", json={
+        "email": f"{username}@example.com", "username": username, "password": PASSWORD,
+    })
+
+
+async def login(client: httpx.AsyncClient, dataset: Dataset, i: int) -> httpx.Response:
+    username = dataset.login_usernames[i % len(dataset.login_usernames)]
+    return await client.post("/token", data={"username": username, "password": PASSWORD})
+
+
+async def create_payment(client: httpx.AsyncClient, dataset: Dataset, i: int) -> httpx.Response:
+    return await client.post("/payments", json=PAYMENT, headers=dataset.auth(i))
+
+
+def list_payments(limit: int):
+    async def request(client: httpx.AsyncClient, dataset: Dataset, i: int) -> httpx.Response:
+        return await client.get("/payments", params={"limit": limit}, headers=dataset.auth(i))
+    return request
+
+
+def demo_get(path: str):
+    async def request(client: httpx.AsyncClient, dataset: Dataset, i: int) -> httpx.Response:
+        return await client.get(path)
+    return request
+
+
+def demo_create(path: str, count: int):
+    async def request(client: httpx.AsyncClient, dataset: Dataset, i: int) -> httpx.Response:
+        return await client.post(path, params={"count": count})
+    return request
+
+
+def scenarios(page_size: int, create_count: int) -> dict:
+    """Scenario name -> request function(client, dataset, i)."""
+    named = {
+        "register": register,
+        "token": login,
+        "payments-create": create_payment,
+        "payments-list": list_payments(page_size),
+    }
+    for path in DEMO_GENERATORS:
+        named[path.rsplit("/", 1)[1]] = demo_get(path)
+    named["create-fake-users"] = demo_create("/demo/create-fake-users", create_count)
+    named["create-fake-payments"] = demo_create("/demo/create-fake-payments", create_count)
+    return named
+
+
+def percentile(ordered: list, p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return float("nan")
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def run_scenario(client: httpx.AsyncClient, dataset: Dataset, request, requests: int,
+                       concurrency: int) -> dict:
+    issued = itertools.count()
+    latencies = []
+    errors = {}
+
+    async def worker():
+        for i in issued:
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                response = await request(client, dataset, i)
+                status = response.status_code
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            latencies.append(time.perf_counter() - start)
+            if not isinstance(status, int) or status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def prepare(client: httpx.AsyncClient, users: int, payments_per_user: int,
+                  concurrency: int) -> Dataset:
+    """Register, log in and preload payments for the dataset's users."""
+    dataset = Dataset(secrets.token_hex(4))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def add_user(login_only: bool):
+        async with semaphore:
+            username = dataset.next_username()
+            response = await client.post("/register", json={
+                "email": f"{username}@example.com", "username": username, "password": PASSWORD,
+            })
+            response.raise_for_status()
+            if login_only:
+                dataset.login_usernames.append(username)
+                return
+            response = await client.post("/token", data={"username": username,
+                                                         "password": PASSWORD})
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            for offset in range(0, payments_per_user, PRELOAD_BATCH_SIZE):
+                batch = [PAYMENT] * min(PRELOAD_BATCH_SIZE, payments_per_user - offset)
+                response = await client.post("/payments/batch", json=batch, headers=headers)
+                response.raise_for_status()
+            dataset.usernames.append(username)
+            dataset.headers.append(headers)
+
+    await asyncio.gather(*(add_user(login_only) for login_only in (False, True)
+                           for _ in range(users)))
+    return dataset
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(port: int, timeout: float = 30.0) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1.0)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"uvicorn did not start within {timeout:.0f}s")
+
+
+def client_for(target: str, base_url: str, max_concurrency: int) -> httpx.AsyncClient:
+    if target == "asgi":
+        from main import app
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load")
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    return httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0)
+
+
+async def run_target(target: str, base_url: str, args) -> list:
+    selected = scenarios(args.page_size, args.create_count)
+    results = []
+    async with client_for(target, base_url, max(args.concurrency)) as client:
+        dataset = await prepare(client, args.users, args.payments_per_user, max(args.concurrency))
+        for name in args.scenarios or selected:
+            for concurrency in args.concurrency:
+                result = await run_scenario(client, dataset, selected[name], args.requests,
+                                            concurrency)
+                result = {"target": target, "scenario": name, "concurrency": concurrency, **result}
+                print_result(result)
+                results.append(result)
+    return results
+
+
+def print_header():
+    print(f"{'target':<9}{'scenario':<30}{'conc':>6}{'rps':>10}{'p50 ms':>10}"
+          f"{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}", flush=True)
+
+
+def print_result(result: dict):
+    print(f"{result['target']:<9}{result['scenario']:<30}{result['concurrency']:>6}"
+          f"{result['rps']:>10,.0f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+          f"{result['p99_ms']:>10.2f}{sum(result['errors'].values()):>8}", flush=True)
+
+
+def compare(baseline_path: str, results: list, tolerance: float) -> bool:
+    """Print the change against a baseline run; return False on any regression."""
+    with open(baseline_path) as f:
+        baseline = {(r["target"], r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    ok = True
+    print(f"\n{'target':<9}{'scenario':<30}{'conc':>6}{'rps':>10}{'p99':>10}")
+    for result in results:
+        before = baseline.get((result["target"], result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        rps_change = (result["rps"] / before["rps"] - 1) * 100
+        p99_change = (result["p99_ms"] / before["p99_ms"] - 1) * 100
+        regressed = rps_change < -tolerance or p99_change > tolerance
+        ok = ok and not regressed
+        print(f"{result['target']:<9}{result['scenario']:<30}{result['concurrency']:>6}"
+              f"{rps_change:>+9.1f}%{p99_change:>+9.1f}%{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", nargs="+", choices=["asgi", "uvicorn"], default=["asgi"])
+    parser.add_argument("--url", help="benchmark an already running server instead of "
+                                      "starting uvicorn")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(scenarios(0, 0)),
+                        help="default: all")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per scenario and concurrency level")
+    parser.add_argument("--users", type=int, default=20, help="users in the dataset")
+    parser.add_argument("--payments-per-user", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=100, help="limit for payments-list")
+    parser.add_argument("--create-count", type=int, default=10,
+                        help="count for create-fake-users and create-fake-payments")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON file from an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="percent change in RPS or p99 counted as a regression")
+    args = parser.parse_args()
+
+    print_header()
+    results = []
+    for target in args.target:
+        if target == "uvicorn" and args.url:
+            results += asyncio.run(run_target(target, args.url.rstrip("/"), args))
+        elif target == "uvicorn":
+            port = free_port()
+            process = start_uvicorn(port)
+            try:
+                results += asyncio.run(run_target(target, f"http://127.0.0.1:{port}", args))
+            finally:
+                process.terminate()
+                process.wait()
+        else:
+            results += asyncio.run(run_target(target, None, args))
+
+    if args.output:
+        meta = {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "env": {name: os.environ[name] for name in
+                    ("STORAGE_BACKEND", "PAYMENT_STORE", "FAST_JSON", "SCRYPT_N",
+                     "PASSWORD_HASH_WORKERS", "TOKEN_MODE", "AUTH_ADMISSION_ENABLED")
+                    if name in os.environ},
+        }
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.compare and not compare(args.compare, results, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
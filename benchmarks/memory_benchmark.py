@@ -0,0 +1,98 @@
+"""
+Report resident memory per payment for the dict and columnar payment stores.
+
+Each (store, rows) pair runs in a fresh subprocess, which measures RSS
+before and after loading the payments. The dict store needs roughly 1.2 KB
+per payment, so 10M rows needs a machine with about 12 GB of free memory.
+Pass smaller --rows to try it on a laptop.
+
+    python benchmarks/memory_benchmark.py --rows 1000000 10000000
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ColumnarPaymentRepository, MemoryPaymentRepository  # noqa: E402
+
+STORES = {"dict": MemoryPaymentRepository, "columnar": ColumnarPaymentRepository}
+STATUSES = ("completed", "pending", "failed")
+BATCH_SIZE = 10_000
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def generate_payments(rows: int, users: int):
+    """Yield payments shaped like create_fake_payments' output, without Faker."""
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    start = datetime.now() - timedelta(days=30)
+    for i in range(rows):
+        card_number = f"4{i:015d}"
+        yield {
+            "payment_id": str(uuid.uuid4()),
+            "user_id": user_ids[i % users],
+            "full_card_number": card_number,
+            "card_last_four": card_number[-4:],
+            "card_holder": f"Holder {i}",
+            "expiry_month": i % 12 + 1,
+            "expiry_year": start.year + i % 5,
+            "cvv": f"{i % 1000:03d}",
+            "amount": (i % 100_000) / 100,
+            "status": STATUSES[i % 3],
+            "timestamp": start + timedelta(microseconds=i * 250),
+            "description": f"Payment {i} " + "lorem ipsum dolor sit amet " * 3,
+        }
+
+
+def measure(store: str, rows: int, users: int) -> int:
+    """Load rows payments into a fresh store; return bytes per payment."""
+    gc.collect()
+    before = rss_bytes()
+    repository = STORES[store]()
+    batch = []
+    for payment in generate_payments(rows, users):
+        batch.append(payment)
+        if len(batch) == BATCH_SIZE:
+            repository.add_many(batch)
+            batch = []
+    repository.add_many(batch)
+    batch = None
+    gc.collect()
+    return (rss_bytes() - before) // rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--stores", nargs="+", choices=sorted(STORES), default=["dict", "columnar"])
+    parser.add_argument("--child", nargs=2, metavar=("STORE", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        store, rows = args.child
+        print(measure(store, int(rows), args.users))
+        return
+
+    print(f"{'store':<10}{'rows':>14}{'bytes/payment':>16}")
+    for rows in args.rows:
+        for store in args.stores:
+            result = subprocess.run(
+                [sys.executable, __file__, "--child", store, str(rows), "--users", str(args.users)],
+                capture_output=True, text=True,
+            )
+            per_payment = result.stdout.strip() if result.returncode == 0 else "failed"
+            print(f"{store:<10}{rows:>14,}{per_payment:>16}")
+
+
+if __name__ == "__main__":
+    main()
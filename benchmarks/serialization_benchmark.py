@@ -0,0 +1,94 @@
+"""
+Compare response serialization cost per endpoint with and without FAST_JSON.
+
+"stock" mirrors FastAPI's usual path: re-validate against the route's
+response_model (where it has one), run jsonable_encoder, then render a
+JSONResponse. "fast" renders the same content with FastJSONResponse. Only
+serialization is timed; no routing, authentication or storage.
+
+    python benchmarks/serialization_benchmark.py --page-size 1000
+"""
+import argparse
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Handlers then hand back plain content, which both variants serialize
+os.environ["FAST_JSON"] = "0"
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import main as api  # noqa: E402
+from main import FastJSONResponse, PaymentResponse  # noqa: E402
+
+DEMO_GENERATORS = {
+    "/demo/generate-user": api.generate_fake_user,
+    "/demo/generate-credit-card": api.generate_fake_credit_card,
+    "/demo/generate-payment": api.generate_fake_payment,
+    "/demo/generate-address": api.generate_fake_address,
+    "/demo/generate-profile": api.generate_fake_profile,
+    "/demo/generate-product": api.generate_fake_product,
+    "/demo/generate-transaction": api.generate_fake_transaction,
+    "/demo/generate-review": api.generate_fake_review,
+}
+
+
+def payment(i: int) -> dict:
+    return api.payment_response({
+        "payment_id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "card_last_four": f"{i % 10000:04d}",
+        "amount": (i % 100_000) / 100,
+        "status": "completed",
+        "timestamp": datetime.now() - timedelta(seconds=i),
+        "description": f"Payment {i}",
+    })
+
+
+def stock(content, model=None) -> bytes:
+    if model is not None:
+        if isinstance(content, list):
+            content = [model(**row) for row in content]
+        else:
+            content = model(**content)
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast(content, model=None) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def endpoints(page_size: int):
+    """(name, content, response_model) for each endpoint measured."""
+    return [
+        (f"GET /payments ({page_size})", [payment(i) for i in range(page_size)], PaymentResponse),
+        ("POST /payments", payment(0), PaymentResponse),
+    ] + [(name, generate(), None) for name, generate in DEMO_GENERATORS.items()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=1.0,
+                        help="approximate time spent timing each variant")
+    args = parser.parse_args()
+
+    print(f"serializer: {'orjson' if api.orjson is not None else 'json'}")
+    print(f"{'endpoint':<32}{'stock us':>12}{'fast us':>12}{'speedup':>10}")
+    for name, content, model in endpoints(args.page_size):
+        timings = []
+        for serialize in (stock, fast):
+            timer = timeit.Timer(lambda: serialize(content, model))
+            number, elapsed = timer.autorange()
+            runs = max(1, int(number * args.seconds / max(elapsed, 1e-9)))
+            timings.append(min(timer.repeat(repeat=3, number=runs)) / runs * 1e6)
+        print(f"{name:<32}{timings[0]:>12,.1f}{timings[1]:>12,.1f}{timings[0] / timings[1]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
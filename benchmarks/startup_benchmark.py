@@ -0,0 +1,132 @@
+"""
+Startup cost of the server under different settings.
+
+Each run launches a fresh uvicorn process and reports:
+
+  ready ms       launch to the first answered request (GET /docs)
+  idle RSS       resident memory after --idle-seconds without traffic
+  first demo ms  the first GET /demo/generate-user, which builds Faker
+  demo RSS       resident memory after that request
+
+A variant is a name followed by VAR=VALUE settings layered over the current
+environment. The defaults compare the stock settings, demo routes turned
+off, and Faker limited to one locale and the providers the routes use.
+
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --variant lean DEMO_ROUTES_ENABLED=0 METRICS_ENABLED=0
+
+RSS is read from /proc, so memory is only reported on Linux.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Faker providers that cover every method the /demo routes call
+DEMO_PROVIDERS = ("address,company,credit_card,date_time,geo,internet,job,lorem,misc,"
+                  "person,phone_number")
+
+DEFAULT_VARIANTS = [
+    ["default"],
+    ["demo-off", "DEMO_ROUTES_ENABLED=0"],
+    ["faker-en_US", "DEMO_FAKER_LOCALES=en_US", f"DEMO_FAKER_PROVIDERS={DEMO_PROVIDERS}"],
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def wait_ready(process: subprocess.Popen, base_url: str, started: float, timeout: float) -> float:
+    """Seconds from started until the server answers a request."""
+    with httpx.Client(base_url=base_url, timeout=1.0) as client:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+            try:
+                client.get("/docs")
+                return time.perf_counter() - started
+            except httpx.TransportError:
+                time.sleep(0.005)
+    raise RuntimeError(f"uvicorn did not start within {timeout:.0f}s")
+
+
+def measure(env: dict, idle_seconds: float, timeout: float) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env={**os.environ, **env},
+    )
+    try:
+        ready = wait_ready(process, base_url, started, timeout)
+        time.sleep(idle_seconds)
+        result = {"ready_ms": ready * 1000, "idle_rss": rss_bytes(process.pid),
+                  "demo_ms": None, "demo_rss": None}
+        request_started = time.perf_counter()
+        response = httpx.get(f"{base_url}/demo/generate-user", timeout=timeout)
+        if response.status_code == 200:
+            result["demo_ms"] = (time.perf_counter() - request_started) * 1000
+            result["demo_rss"] = rss_bytes(process.pid)
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def median(results: list, key: str):
+    values = [result[key] for result in results if result[key] is not None]
+    return statistics.median(values) if values else None
+
+
+def format_value(value, scale: float = 1.0, unit: str = "") -> str:
+    return "-" if value is None else f"{value / scale:,.1f}{unit}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variant", nargs="+", action="append", metavar="NAME [VAR=VALUE]",
+                        help="settings to measure; repeatable (default: three built-in variants)")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per variant")
+    parser.add_argument("--idle-seconds", type=float, default=2.0,
+                        help="wait after startup before reading idle RSS")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(f"{'variant':<16}{'ready ms':>10}{'idle RSS':>12}{'first demo ms':>15}{'demo RSS':>12}"
+          "   (medians)")
+    for name, *settings in args.variant or DEFAULT_VARIANTS:
+        env = dict(setting.split("=", 1) for setting in settings)
+        results = [measure(env, args.idle_seconds, args.timeout) for _ in range(args.runs)]
+        mib = 1024 * 1024
+        print(f"{name:<16}{format_value(median(results, 'ready_ms')):>10}"
+              f"{format_value(median(results, 'idle_rss'), mib, ' MiB'):>12}"
+              f"{format_value(median(results, 'demo_ms')):>15}"
+              f"{format_value(median(results, 'demo_rss'), mib, ' MiB'):>12}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare storage backend throughput for the operations behind register,
+login, payment creation and payment listing.
+
+Password hashing is left out (every user gets the same precomputed hash)
+because it costs the same on every backend and would drown out the
+difference this benchmark is after.
+
+    python benchmarks/storage_benchmark.py --users 2000 --payments-per-user 20
+"""
+import argparse
+import os
+import secrets
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import create_storage  # noqa: E402
+
+HASHED_PASSWORD = "scrypt$16384$8$1$" + "00" * 16 + "$" + "00" * 32
+
+
+def make_payment(user_id: str, timestamp: datetime) -> dict:
+    return {
+        "payment_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "full_card_number": "4111111111111111",
+        "card_last_four": "1111",
+        "card_holder": "Bench User",
+        "expiry_month": 12,
+        "expiry_year": timestamp.year + 2,
+        "cvv": "123",
+        "amount": 42.5,
+        "status": "completed",
+        "timestamp": timestamp,
+        "description": "benchmark payment",
+    }
+
+
+def timed(operation, items) -> float:
+    """Run operation over items and return operations per second."""
+    start = time.perf_counter()
+    for item in items:
+        operation(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def run_backend(backend: str, users: int, payments_per_user: int, page_size: int,
+                workdir: str) -> dict:
+    storage = create_storage(backend, token_ttl_seconds=3600, max_tokens_per_user=10,
+                             sqlite_path=os.path.join(workdir, f"{backend}.db"))
+    try:
+        user_records = [
+            {"email": f"user{i}@example.com", "username": f"user{i}",
+             "hashed_password": HASHED_PASSWORD, "user_id": str(uuid.uuid4())}
+            for i in range(users)
+        ]
+        results = {"register": timed(storage.users.add, user_records)}
+
+        def login(user):
+            storage.users.get(user["username"])
+            storage.tokens.issue(secrets.token_urlsafe(32), user["username"])
+        results["login"] = timed(login, user_records)
+
+        now = datetime.now()
+        payments = [
+            make_payment(user["user_id"], now - timedelta(seconds=n))
+            for n in range(payments_per_user) for user in user_records
+        ]
+        results["create_payment"] = timed(storage.payments.add, payments)
+
+        def list_payments(user):
+            storage.payments.list_for_user(user["user_id"], page_size)
+        results["list_payments"] = timed(list_payments, user_records)
+        return results
+    finally:
+        storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--payments-per-user", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {
+            backend: run_backend(backend, args.users, args.payments_per_user,
+                                 args.page_size, workdir)
+            for backend in args.backends
+        }
+
+    operations = ["register", "login", "create_payment", "list_payments"]
+    print(f"{'operation':<16}" + "".join(f"{backend + ' ops/s':>18}" for backend in results))
+    for operation in operations:
+        print(f"{operation:<16}" + "".join(f"{results[b][operation]:>18,.0f}" for b in results))
+
+
+if __name__ == "__main__":
+    main()
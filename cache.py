@@ -0,0 +1,72 @@
+"""
+In-process caches.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Least-recently-used cache holding at most max_entries values, each of
+    which expires ttl_seconds after it was stored. With max_bytes, the sizes
+    passed to set() are also kept to that total; a value larger than
+    max_bytes on its own is not stored.
+
+    Expired entries are dropped when they are looked up or when they reach
+    the cold end of the LRU order, so no background sweep is needed.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value, nbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self.pop(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, nbytes: int = 0):
+        self.pop(key)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+        ttl = self.ttl_seconds if self.ttl_seconds is not None else float("inf")
+        self._entries[key] = (time.monotonic() + ttl, value, nbytes)
+        self.nbytes += nbytes
+        while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.nbytes > self.max_bytes):
+            _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_bytes
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.nbytes -= entry[2]
+        return entry[1]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
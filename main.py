@@ -1,25 +1,330 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import APIRouter, FastAPI, HTTPException, Body, Depends, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr, Field, SecretStr, validator
-from typing import Optional, List
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, EmailStr, Field, SecretStr, ValidationError, validator
+from typing import AsyncIterator, Dict, Iterable, Optional, List, Union
 import re
+import os
+import csv
+import json
+import math
+import time
+import asyncio
+import base64
+import binascii
 import hashlib
+import hmac
 import uuid
 import secrets
-from datetime import datetime, timedelta
-from faker import Faker
-import subprocess  # Added for shell command execution
+import threading
+import codecs
+import signal
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from cache import LRUCache
+from persistence import Persistence
+from pipeline import PaymentPipeline, SimulatedProcessor
+from metrics import Metrics, MetricsMiddleware, SamplingProfiler, render_folded
+from pools import RecordPool
+from ratelimit import TokenBucketLimiter
+from seed import (DEFAULT_BASE_TIME as SEED_DEFAULT_BASE_TIME, DEFAULT_PASSWORD as SEED_DEFAULT_PASSWORD,
+                  seed_storage)
+from storage import create_storage
+
+try:
+    import orjson
+except ImportError:  # optional; responses fall back to the json module
+    orjson = None
+
+# --- Settings ---
+
+# "memory" keeps everything in this process; "sqlite" persists to SQLITE_PATH
+# and can be shared by several worker processes
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+# Worker processes uvicorn starts (the default for its --workers). Each
+# worker has its own memory backend, so more than one needs sqlite.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Payment layout for the memory backend: "dict" or the compact "columnar"
+PAYMENT_STORE = os.environ.get("PAYMENT_STORE", "dict")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "api.db")
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+# Directory for the memory backend's snapshots and journals, so its state
+# survives restarts; unset keeps it in memory only. Snapshots are taken
+# every SNAPSHOT_INTERVAL seconds when anything changed, and journals are
+# fsynced every FSYNC_INTERVAL seconds (the most a crash can lose).
+PERSIST_DIR = os.environ.get("PERSIST_DIR", "")
+PERSIST_SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get("PERSIST_SNAPSHOT_INTERVAL_SECONDS", "300"))
+PERSIST_FSYNC_INTERVAL_SECONDS = float(os.environ.get("PERSIST_FSYNC_INTERVAL_SECONDS", "1"))
+# Access tokens expire after this many seconds
+TOKEN_TTL_SECONDS = int(os.environ.get("TOKEN_TTL_SECONDS", "3600"))
+# Issuing a token beyond this many live tokens for one user evicts the oldest
+MAX_TOKENS_PER_USER = int(os.environ.get("MAX_TOKENS_PER_USER", "10"))
+# Hard cap on live tokens; the soonest-expiring token is evicted past it
+TOKEN_STORE_MAX_SIZE = int(os.environ.get("TOKEN_STORE_MAX_SIZE", "1000000"))
+# Background sweep period and the most heap entries examined per sweep
+TOKEN_SWEEP_INTERVAL_SECONDS = float(os.environ.get("TOKEN_SWEEP_INTERVAL_SECONDS", "1"))
+TOKEN_SWEEP_BATCH = int(os.environ.get("TOKEN_SWEEP_BATCH", "1000"))
+# "opaque" tokens live in tokens_db; "signed" tokens are self-contained
+# HMAC-signed claims that any worker holding the same keys can verify
+TOKEN_MODE = os.environ.get("TOKEN_MODE", "opaque")
+# Signing keys as "kid:secret,kid:secret"; new tokens use TOKEN_SIGNING_KEY_ID.
+# Without configured keys each process generates its own, so multi-worker
+# deployments must set these.
+TOKEN_SIGNING_KEYS = dict(
+    entry.split(":", 1)
+    for entry in os.environ.get("TOKEN_SIGNING_KEYS", "").split(",") if entry
+) or {"local": secrets.token_urlsafe(32)}
+TOKEN_SIGNING_KEY_ID = os.environ.get("TOKEN_SIGNING_KEY_ID", next(iter(TOKEN_SIGNING_KEYS)))
+# Most payments accepted by one POST /payments/batch request
+PAYMENT_BATCH_MAX_SIZE = int(os.environ.get("PAYMENT_BATCH_MAX_SIZE", "1000"))
+# "inline" completes payments while handling the request; "pipeline" stores
+# them as pending and background workers submit them to the payment
+# processor in micro-batches, so requests never wait on the processor
+PAYMENT_MODE = os.environ.get("PAYMENT_MODE", "inline")
+# Pending payments queued for the processor (requests past it get 503, and
+# batches larger than it 413), the workers draining the queue, the most
+# payments per processor call and the longest a worker waits for a call to fill
+PAYMENT_QUEUE_SIZE = int(os.environ.get("PAYMENT_QUEUE_SIZE", "10000"))
+PAYMENT_WORKERS = int(os.environ.get("PAYMENT_WORKERS", "4"))
+PAYMENT_PROCESSOR_BATCH_SIZE = int(os.environ.get("PAYMENT_PROCESSOR_BATCH_SIZE", "100"))
+PAYMENT_PROCESSOR_BATCH_WAIT_SECONDS = float(os.environ.get("PAYMENT_PROCESSOR_BATCH_WAIT_SECONDS", "0.005"))
+# How long shutdown waits for queued payments to be processed
+PAYMENT_DRAIN_SECONDS = float(os.environ.get("PAYMENT_DRAIN_SECONDS", "10"))
+# Latency per call and failure rate of the simulated processor
+PROCESSOR_LATENCY_SECONDS = float(os.environ.get("PROCESSOR_LATENCY_SECONDS", "0.05"))
+PROCESSOR_LATENCY_JITTER_SECONDS = float(os.environ.get("PROCESSOR_LATENCY_JITTER_SECONDS", "0.05"))
+PROCESSOR_FAILURE_RATE = float(os.environ.get("PROCESSOR_FAILURE_RATE", "0.02"))
+# Stored POST /payments responses replayed for a repeated Idempotency-Key
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "100000"))
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# Serialized GET /payments pages kept for repeat polls, by entries and bytes
+PAYMENTS_PAGE_CACHE_SIZE = int(os.environ.get("PAYMENTS_PAGE_CACHE_SIZE", "10000"))
+PAYMENTS_PAGE_CACHE_BYTES = int(os.environ.get("PAYMENTS_PAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Serve the /demo/* routes; replicas that never use them can leave them out
+DEMO_ROUTES_ENABLED = os.environ.get("DEMO_ROUTES_ENABLED", "1") == "1"
+# Comma-separated locales (e.g. "en_US,de_DE") and provider modules (e.g.
+# "person" or "faker.providers.person") loaded by the demo routes' Faker;
+# empty loads Faker's defaults. They must cover every method the routes call
+# (e.g. zipcode, which not all locales have). Faker is imported on first use.
+DEMO_FAKER_LOCALES = [locale for locale in os.environ.get("DEMO_FAKER_LOCALES", "").split(",")
+                      if locale]
+DEMO_FAKER_PROVIDERS = [
+    provider if "." in provider else f"faker.providers.{provider}"
+    for provider in os.environ.get("DEMO_FAKER_PROVIDERS", "").split(",") if provider
+]
+# Pre-generated records kept per /demo/generate-* pool, the level that
+# triggers a background refill, and the number of refill threads
+DEMO_POOL_SIZE = int(os.environ.get("DEMO_POOL_SIZE", "1000"))
+DEMO_POOL_LOW_WATER = int(os.environ.get("DEMO_POOL_LOW_WATER", "250"))
+DEMO_POOL_REFILL_WORKERS = int(os.environ.get("DEMO_POOL_REFILL_WORKERS", "1"))
+# Fill the pools to DEMO_POOL_LOW_WATER before serving, so the first demo
+# requests do not miss. Off by default: it imports Faker at startup, which
+# replicas that never use the demo routes should not pay for
+DEMO_POOL_WARM_AT_STARTUP = os.environ.get("DEMO_POOL_WARM_AT_STARTUP", "0") == "1"
+# Largest count accepted by /demo/create-fake-*; bigger fixtures go through
+# the bulk seeder (POST /demo/seed or seed.py)
+DEMO_CREATE_MAX_COUNT = int(os.environ.get("DEMO_CREATE_MAX_COUNT", "10000"))
+SEED_MAX_USERS = int(os.environ.get("SEED_MAX_USERS", "10000000"))
+# scrypt cost parameters for new password hashes
+SCRYPT_N = int(os.environ.get("SCRYPT_N", "16384"))
+SCRYPT_R = int(os.environ.get("SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("SCRYPT_P", "1"))
+# Password hashes run on this many threads; past QUEUE_LIMIT waiting hashes
+# /register and /token answer 503 instead of queueing
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+# POST /admin/import-users handles rows in batches of BATCH_SIZE. Bulk
+# hashing (imports and /demo/create-fake-*) uses at most HASH_WORKERS of the
+# password hash threads, so logins keep the rest. An imported row (one
+# line, or one quoted CSV record) may be at most MAX_ROW_BYTES long.
+USER_IMPORT_BATCH_SIZE = int(os.environ.get("USER_IMPORT_BATCH_SIZE", "500"))
+USER_IMPORT_HASH_WORKERS = int(os.environ.get("USER_IMPORT_HASH_WORKERS",
+                                              str(max(1, PASSWORD_HASH_WORKERS // 2))))
+USER_IMPORT_MAX_ROW_BYTES = int(os.environ.get("USER_IMPORT_MAX_ROW_BYTES", str(64 * 1024)))
+# Admission control for /token and /register, applied before any password
+# hashing: token buckets per username and per client IP (tokens per second
+# and burst), the most buckets kept for each, and the auth requests handled
+# at once. Requests past any of them get 429 with Retry-After. Client IPs
+# come from the connection (or X-Forwarded-For with uvicorn --proxy-headers).
+AUTH_ADMISSION_ENABLED = os.environ.get("AUTH_ADMISSION_ENABLED", "1") == "1"
+AUTH_USERNAME_RATE = float(os.environ.get("AUTH_USERNAME_RATE", "0.2"))
+AUTH_USERNAME_BURST = float(os.environ.get("AUTH_USERNAME_BURST", "10"))
+AUTH_IP_RATE = float(os.environ.get("AUTH_IP_RATE", "2"))
+AUTH_IP_BURST = float(os.environ.get("AUTH_IP_BURST", "20"))
+AUTH_RATE_LIMIT_MAX_KEYS = int(os.environ.get("AUTH_RATE_LIMIT_MAX_KEYS", "100000"))
+AUTH_MAX_CONCURRENCY = int(os.environ.get("AUTH_MAX_CONCURRENCY", str(2 * PASSWORD_HASH_WORKERS)))
+# Record per-route request counts and latency histograms, served at /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# Allow POST /admin/profile to sample thread stacks, for at most this many seconds
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+PROFILER_MAX_SECONDS = float(os.environ.get("PROFILER_MAX_SECONDS", "60"))
+# Admin shell commands running at once (further requests get 503), their
+# timeouts, and the output kept per background job for streaming
+COMMAND_MAX_CONCURRENCY = int(os.environ.get("COMMAND_MAX_CONCURRENCY", "4"))
+COMMAND_TIMEOUT_SECONDS = float(os.environ.get("COMMAND_TIMEOUT_SECONDS", "30"))
+COMMAND_JOB_TIMEOUT_SECONDS = float(os.environ.get("COMMAND_JOB_TIMEOUT_SECONDS", "3600"))
+COMMAND_JOB_OUTPUT_LIMIT = int(os.environ.get("COMMAND_JOB_OUTPUT_LIMIT", str(10 * 1024 * 1024)))
+
+async def sweep_expired_tokens():
+    """Background task that periodically drops expired tokens."""
+    while True:
+        await asyncio.sleep(TOKEN_SWEEP_INTERVAL_SECONDS)
+        await run_storage(tokens_db.sweep, TOKEN_SWEEP_BATCH)
+        await run_storage(revoked_tokens.sweep, TOKEN_SWEEP_BATCH)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if persistence is not None:
+        persistence.open()
+        persistence.start()
+    if payment_pipeline is not None:
+        payment_pipeline.start()
+    if DEMO_ROUTES_ENABLED and DEMO_POOL_WARM_AT_STARTUP:
+        await asyncio.gather(*(asyncio.wrap_future(pool.warm())
+                               for pool in (profile_pool, transaction_pool, review_pool)))
+    sweeper = asyncio.create_task(sweep_expired_tokens())
+    yield
+    sweeper.cancel()
+    if payment_pipeline is not None:
+        await payment_pipeline.stop(PAYMENT_DRAIN_SECONDS)
+    for job in command_jobs.values():
+        if job.task is not None:
+            job.task.cancel()  # kills the command's process group
+    password_hash_executor.shutdown(wait=False)
+    demo_pool_executor.shutdown(wait=False, cancel_futures=True)
+    if persistence is not None:
+        persistence.close()
+    storage.close()
 
 # Initialize FastAPI app
-app = FastAPI(title="Secure API Example")
+app = FastAPI(title="Secure API Example", lifespan=lifespan)
+
+def new_faker():
+    """A Faker for DEMO_FAKER_LOCALES with DEMO_FAKER_PROVIDERS."""
+    from faker import Faker  # deferred, as importing faker is a large part of startup
+    return Faker(DEMO_FAKER_LOCALES or None, providers=DEMO_FAKER_PROVIDERS or None)
+
+class LazyFaker:
+    """Stands in for a Faker, building it with make_faker on first use."""
+
+    def __init__(self, make_faker):
+        self._make_faker = make_faker
+        self._faker = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        faker = self._faker
+        if faker is None:
+            # Sync demo routes run on the threadpool, so first uses can race
+            with self._lock:
+                if self._faker is None:
+                    self._faker = self._make_faker()
+                faker = self._faker
+        return getattr(faker, name)
+
+# Initialize Faker on first use
+fake = LazyFaker(new_faker)
+
+# Routes under /demo register on the app, or on a router that is never
+# included when DEMO_ROUTES_ENABLED is off
+demo = app if DEMO_ROUTES_ENABLED else APIRouter()
+
+# Database (in-memory by default, for demo purposes only)
+# Users, tokens, revocations and payments would differ from worker to
+# worker, whatever the token mode
+if STORAGE_BACKEND == "memory" and WEB_CONCURRENCY > 1:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={WEB_CONCURRENCY} needs a shared store: set STORAGE_BACKEND=sqlite "
+        "(the memory backend is per process)"
+    )
+
+storage = create_storage(
+    STORAGE_BACKEND,
+    token_ttl_seconds=TOKEN_TTL_SECONDS,
+    max_tokens_per_user=MAX_TOKENS_PER_USER,
+    max_tokens=TOKEN_STORE_MAX_SIZE,
+    payment_store=PAYMENT_STORE,
+    sqlite_path=SQLITE_PATH,
+    sqlite_pool_size=SQLITE_POOL_SIZE,
+)
+users_db = storage.users
+tokens_db = storage.tokens
+# Revoked signed tokens: jti -> username, kept only until the token would expire
+revoked_tokens = storage.revoked_tokens
+payments_db = storage.payments
 
-# Initialize Faker
-fake = Faker()
+async def run_storage(func, *args):
+    """
+    Call a repository method from the event loop. SQLite calls can wait for
+    a pooled connection or on busy_timeout, so they run on the default
+    executor; memory backend calls are quick and run inline.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    return func(*args)
+# SQLite is durable by itself; only the memory backend needs persistence
+persistence = None
+if PERSIST_DIR and STORAGE_BACKEND == "memory":
+    persistence = Persistence(storage, PERSIST_DIR, PERSIST_SNAPSHOT_INTERVAL_SECONDS,
+                              PERSIST_FSYNC_INTERVAL_SECONDS)
+
+# Payment processing in pipeline mode; a real processor would implement
+# pipeline.PaymentProcessor in place of the simulated one
+payment_pipeline = None
+if PAYMENT_MODE == "pipeline":
+    payment_pipeline = PaymentPipeline(
+        SimulatedProcessor(PROCESSOR_LATENCY_SECONDS, PROCESSOR_LATENCY_JITTER_SECONDS,
+                           PROCESSOR_FAILURE_RATE),
+        payments_db.update_statuses,
+        queue_size=PAYMENT_QUEUE_SIZE,
+        workers=PAYMENT_WORKERS,
+        batch_size=PAYMENT_PROCESSOR_BATCH_SIZE,
+        batch_wait=PAYMENT_PROCESSOR_BATCH_WAIT_SECONDS,
+    )
+
+# Request metrics, plus store sizes read when /metrics is scraped
+metrics = Metrics()
+metrics.add_gauge("app_store_records", "Records held in each store.", "store", {
+    "users": lambda: len(users_db),
+    "tokens": lambda: len(tokens_db),
+    "payments": lambda: len(payments_db),
+})
+if payment_pipeline is not None:
+    metrics.add_gauge("app_payment_pipeline_payments",
+                      "Payments queued for or being processed by the payment processor.", "state", {
+        "queued": lambda: payment_pipeline.stats()["queued"],
+        "processing": lambda: payment_pipeline.processing,
+    })
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, metrics=metrics, router=app.router)
+profiler = SamplingProfiler()
+
+# Return server-built responses from hot routes directly as FastJSONResponse,
+# skipping response_model re-validation and jsonable_encoder
+FAST_JSON = os.environ.get("FAST_JSON", "1") == "1"
+
+# Page size limits for GET /payments
+PAYMENTS_PAGE_DEFAULT_LIMIT = 100
+PAYMENTS_PAGE_MAX_LIMIT = 1000
+
+# GET /payments ETags are built from the user's payment version. Memory
+# backend versions restart with the process, so its ETags also carry a
+# per-process token; SQLite versions are stored and shared by all workers.
+PAYMENTS_ETAG_PREFIX = secrets.token_hex(4) if STORAGE_BACKEND == "memory" else "db"
+# Serialized pages by (user_id, query), with the version they were built at
+payments_page_cache = LRUCache(PAYMENTS_PAGE_CACHE_SIZE, max_bytes=PAYMENTS_PAGE_CACHE_BYTES)
 
-# In-memory database (for demo purposes only - use a real DB in production)
-users_db = {}
-tokens_db = {}
-payments_db = {}
+# Rows per chunk when streaming NDJSON, and per insert batch in /demo/create-fake-*
+STREAM_CHUNK_SIZE = 500
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Idempotency-Key handling for POST /payments: responses by (user_id, key),
+# and an event per key whose first request is still being processed
+idempotency_cache = LRUCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+idempotency_in_flight = {}
 
 # OAuth2 token scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -58,6 +363,7 @@ class UserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: Optional[int] = None
 
 class CreditCard(BaseModel):
     card_number: str
@@ -97,46 +403,257 @@ class PaymentResponse(BaseModel):
     status: str
     timestamp: datetime
 
+class PaymentTotals(BaseModel):
+    count: int
+    total: float
+
+class PaymentSummary(BaseModel):
+    count: int
+    total: float
+    by_status: Dict[str, PaymentTotals]
+    by_day: Dict[str, PaymentTotals]
+
 class PaymentRequest(BaseModel):
     credit_card: CreditCard
     amount: float = Field(gt=0)
     description: Optional[str] = None
+    
+    @validator('amount')
+    def validate_amount(cls, v):
+        # Stores and summaries keep amounts in whole cents
+        if round(v, 2) != v:
+            raise ValueError('Amount must not have more than two decimal places')
+        return v
+
+class PaymentError(BaseModel):
+    loc: List[Union[str, int]]
+    msg: str
+
+class BatchPaymentResult(BaseModel):
+    index: int
+    success: bool
+    payment: Optional[PaymentResponse] = None
+    errors: Optional[List[PaymentError]] = None
+
+class SeedRequest(BaseModel):
+    users: int = Field(gt=0, le=SEED_MAX_USERS)
+    payments_per_user: int = Field(0, ge=0, le=1000)
+    seed: int = 0
+    workers: Optional[int] = Field(None, gt=0)
+    password: str = SEED_DEFAULT_PASSWORD
+    base_time: datetime = SEED_DEFAULT_BASE_TIME
 
 # New model for shell command execution
 class ShellCommandRequest(BaseModel):
     password: str
     command: str
+    # Run as a background job: return a job id at once and stream the output
+    # from GET /admin/command-jobs/{job_id}/output
+    background: bool = False
 
 # --- Security functions ---
 
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r, dklen=32)
+
 def hash_password(password: str) -> str:
     """Hash a password for storage."""
-    salt = secrets.token_hex(16)
-    pwdhash = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}${pwdhash}"
+    salt = secrets.token_bytes(16)
+    pwdhash = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${pwdhash.hex()}"
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    return [hash_password(password) for password in passwords]
 
 def verify_password(stored_password: str, provided_password: str) -> bool:
     """Verify a stored password against a provided password."""
-    salt, stored_hash = stored_password.split('$')
-    pwdhash = hashlib.sha256((provided_password + salt).encode()).hexdigest()
-    return pwdhash == stored_hash
+    parts = stored_password.split('$')
+    if parts[0] == "scrypt":
+        _, n, r, p, salt, stored_hash = parts
+        pwdhash = _scrypt(provided_password, bytes.fromhex(salt), int(n), int(r), int(p)).hex()
+    else:
+        # Legacy salt$sha256 hash
+        salt, stored_hash = parts
+        pwdhash = hashlib.sha256((provided_password + salt).encode()).hexdigest()
+    return hmac.compare_digest(pwdhash, stored_hash)
+
+def password_needs_rehash(stored_password: str) -> bool:
+    """Whether a stored hash predates the current scheme or cost parameters."""
+    return not stored_password.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+def verify_and_update_password(stored_password: str, provided_password: str):
+    """
+    Verify a password and, if the stored hash is outdated, compute its
+    replacement in the same call. Returns (valid, new_hash_or_None).
+    """
+    if not verify_password(stored_password, provided_password):
+        return False, None
+    if password_needs_rehash(stored_password):
+        return True, hash_password(provided_password)
+    return True, None
+
+# Hardcoded password - in a real scenario, use a much stronger authentication mechanism
+# and preferably environment variables rather than hardcoded values
+ADMIN_PASSWORD = "super_secret_admin_password_123!"
+
+def check_admin_password(password: Optional[str]):
+    if password != ADMIN_PASSWORD:
+        # Use a generic error message to avoid leaking information
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed"
+        )
+
+def require_admin(x_admin_password: Optional[str] = Header(None)):
+    """Admin routes without a JSON body take the admin password in an X-Admin-Password header."""
+    check_admin_password(x_admin_password)
+
+# Password hashing is deliberately slow, so it runs on its own threads
+# (hashlib releases the GIL) instead of blocking the event loop
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+password_hash_pending = 0
+
+async def run_password_hash(func, *args):
+    """Run a password hashing function on the worker pool, or 503 if it is saturated."""
+    global password_hash_pending
+    if password_hash_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    password_hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_hash_executor, func, *args)
+    finally:
+        password_hash_pending -= 1
+
+async def run_bulk_password_hash(passwords: List[str]) -> List[str]:
+    """
+    Hash many passwords on at most USER_IMPORT_HASH_WORKERS of the worker
+    threads. Bulk work waits for its turn instead of answering 503.
+    """
+    global password_hash_pending
+    if not passwords:
+        return []
+    size = math.ceil(len(passwords) / USER_IMPORT_HASH_WORKERS)
+    chunks = [passwords[start:start + size] for start in range(0, len(passwords), size)]
+    password_hash_pending += len(chunks)
+    try:
+        loop = asyncio.get_running_loop()
+        hashed = await asyncio.gather(*(
+            loop.run_in_executor(password_hash_executor, hash_passwords, chunk) for chunk in chunks
+        ))
+    finally:
+        password_hash_pending -= len(chunks)
+    return [hashed_password for chunk in hashed for hashed_password in chunk]
 
-def get_user(username: str):
+# Admission control state for /token and /register
+username_limiter = TokenBucketLimiter(AUTH_USERNAME_RATE, AUTH_USERNAME_BURST, AUTH_RATE_LIMIT_MAX_KEYS)
+client_ip_limiter = TokenBucketLimiter(AUTH_IP_RATE, AUTH_IP_BURST, AUTH_RATE_LIMIT_MAX_KEYS)
+auth_in_flight = 0
+auth_concurrency_rejections = 0
+
+def check_auth_rate(limiter: TokenBucketLimiter, key: str, subject: str):
+    """Spend a token from key's bucket, or raise 429 with the wait as Retry-After."""
+    wait = limiter.acquire(key)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many authentication attempts for this {subject}; retry later",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+def check_username_rate(username: str):
+    """Per-username admission for /token and /register; call before any hashing."""
+    if AUTH_ADMISSION_ENABLED:
+        # Login usernames are not length-checked, so bound the key size
+        check_auth_rate(username_limiter, username[:256], "username")
+
+async def admit_auth_request(request: Request):
+    """
+    Dependency of /token and /register: 429 past the client IP's rate or
+    the auth concurrency ceiling, holding a slot while the request runs.
+    """
+    global auth_in_flight, auth_concurrency_rejections
+    if not AUTH_ADMISSION_ENABLED:
+        yield
+        return
+    check_auth_rate(client_ip_limiter, request.client.host if request.client else "", "client")
+    if auth_in_flight >= AUTH_MAX_CONCURRENCY:
+        auth_concurrency_rejections += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many authentication requests in progress; retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    auth_in_flight += 1
+    try:
+        yield
+    finally:
+        auth_in_flight -= 1
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(key_id: str, body: str) -> str:
+    key = TOKEN_SIGNING_KEYS[key_id].encode()
+    return b64url_encode(hmac.new(key, f"{key_id}.{body}".encode(), hashlib.sha256).digest())
+
+def create_signed_token(username: str) -> str:
+    """Issue a self-contained "kid.claims.signature" access token."""
+    claims = {
+        "sub": username,
+        "exp": int(time.time()) + TOKEN_TTL_SECONDS,
+        "kid": TOKEN_SIGNING_KEY_ID,
+        "jti": secrets.token_urlsafe(12)
+    }
+    body = b64url_encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{TOKEN_SIGNING_KEY_ID}.{body}.{_sign(TOKEN_SIGNING_KEY_ID, body)}"
+
+def decode_signed_token(token: str) -> Optional[dict]:
+    """Return the claims of a validly signed, unexpired token, or None."""
+    try:
+        key_id, body, signature = token.split(".")
+        if key_id not in TOKEN_SIGNING_KEYS:
+            return None
+        if not hmac.compare_digest(signature, _sign(key_id, body)):
+            return None
+        claims = json.loads(b64url_decode(body))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if claims.get("kid") != key_id or claims["exp"] <= time.time():
+        return None
+    return claims
+
+async def get_user(username: str):
     """Get a user from the database."""
-    if username in users_db:
-        return users_db[username]
-    return None
+    return await run_storage(users_db.get, username)
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Get the current user from the token."""
-    if token not in tokens_db:
+    if TOKEN_MODE == "signed":
+        claims = decode_signed_token(token)
+        if claims is None or await run_storage(revoked_tokens.get, claims["jti"]) is not None:
+            username = None
+        else:
+            username = claims["sub"]
+    else:
+        username = await run_storage(tokens_db.get, token)
+    if username is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    username = tokens_db[token]
-    user = get_user(username)
+    user = await get_user(username)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -145,12 +662,241 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         )
     return user
 
+# --- Payment cursors ---
+
+def encode_cursor(key) -> str:
+    """Encode a (timestamp, payment_id) index key as an opaque cursor."""
+    timestamp, payment_id = key
+    return b64url_encode(f"{timestamp.isoformat()}|{payment_id}".encode())
+
+def decode_cursor(cursor: str):
+    """Decode a cursor produced by encode_cursor back into an index key."""
+    try:
+        raw = b64url_decode(cursor).decode()
+        timestamp, payment_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), str(uuid.UUID(payment_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def to_naive(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive local time; convert an aware query value to match."""
+    if timestamp is None or timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
+# --- Responses ---
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dump_json(content) -> bytes:
+    """Serialize content compactly, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=json_default, ensure_ascii=False,
+                      separators=(",", ":")).encode()
+
+class FastJSONResponse(JSONResponse):
+    """JSON response that serializes datetimes itself instead of via jsonable_encoder."""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+def fast_response(content, response: Optional[Response] = None, headers: Optional[dict] = None):
+    """
+    Return content the server built itself. With FAST_JSON it goes out as a
+    FastJSONResponse; otherwise it is handed back to FastAPI's usual
+    response_model path, with any headers set on response.
+    """
+    if FAST_JSON:
+        return FastJSONResponse(content, headers=headers)
+    if headers:
+        response.headers.update(headers)
+    return content
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag, by weak comparison."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.replace("W/", "", 1) == etag:
+            return True
+    return False
+
+def wants_ndjson(request: Request) -> bool:
+    """Whether the client asked for a streamed NDJSON response."""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(batches: Union[Iterable[List[dict]], AsyncIterator[List[dict]]]) -> StreamingResponse:
+    """
+    Stream rows as newline-delimited JSON, one chunk per batch, so only one
+    batch is ever held in memory. Sync generators run on the threadpool,
+    async ones on the event loop.
+    """
+    if hasattr(batches, "__aiter__"):
+        async def chunks():
+            async for batch in batches:
+                yield b"".join(dump_json(row) + b"\n" for row in batch)
+    else:
+        def chunks():
+            for batch in batches:
+                yield b"".join(dump_json(row) + b"\n" for row in batch)
+    return StreamingResponse(chunks(), media_type=NDJSON_MEDIA_TYPE)
+
+# --- Idempotency ---
+
+class IdempotentReplay(Exception):
+    """Raised to answer a request with the stored response for its key."""
+
+    def __init__(self, content: dict):
+        self.content = content
+
+@app.exception_handler(IdempotentReplay)
+async def replay_idempotent_response(request: Request, exc: IdempotentReplay):
+    return FastJSONResponse(exc.content, headers={"Idempotent-Replayed": "true"})
+
+async def claim_idempotency_key(
+    idempotency_key: Optional[str] = Header(None),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Claim the request's Idempotency-Key, or replay the response stored for it.
+    
+    This runs before the request body is parsed, so a replay skips
+    validation entirely. While the first request with a key is in flight,
+    later ones wait for it and then replay its response. If it fails,
+    nothing is stored and the next waiter takes over the key.
+    """
+    if idempotency_key is None:
+        yield None
+        return
+    if len(idempotency_key) > 255:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Idempotency-Key must be at most 255 characters"
+        )
+    
+    cache_key = (user["user_id"], idempotency_key)
+    while True:
+        content = idempotency_cache.get(cache_key)
+        if content is not None:
+            raise IdempotentReplay(content)
+        in_flight = idempotency_in_flight.get(cache_key)
+        if in_flight is None:
+            break
+        await in_flight.wait()
+    
+    done = idempotency_in_flight[cache_key] = asyncio.Event()
+    try:
+        yield cache_key
+    finally:
+        del idempotency_in_flight[cache_key]
+        done.set()
+
+# --- Fake data generators ---
+
+def fake_profile(faker) -> dict:
+    """A complete fake user profile."""
+    return {
+        "id": str(uuid.uuid4()),
+        "username": faker.user_name(),
+        "email": faker.email(),
+        "name": faker.name(),
+        "birthdate": faker.date_of_birth(minimum_age=18, maximum_age=90).isoformat(),
+        "phone_number": faker.phone_number(),
+        "job": faker.job(),
+        "company": faker.company(),
+        "address": {
+            "street": faker.street_address(),
+            "city": faker.city(),
+            "state": faker.state(),
+            "country": faker.country(),
+            "zipcode": faker.zipcode()
+        },
+        "website": faker.url(),
+        "profile_picture": faker.image_url(),
+        "bio": faker.paragraph(nb_sentences=3),
+        "registration_date": faker.date_time_this_year().isoformat()
+    }
+
+def fake_transaction(faker) -> dict:
+    """A fake transaction with one to five products."""
+    product_count = faker.random_int(min=1, max=5)
+    products = []
+    total = 0
+    
+    for _ in range(product_count):
+        price = round(float(faker.random_number(digits=2) + faker.random_number(digits=2)/100), 2)
+        quantity = faker.random_int(min=1, max=10)
+        products.append({
+            "product_id": str(uuid.uuid4()),
+            "name": faker.catch_phrase(),
+            "price": price,
+            "quantity": quantity,
+            "subtotal": round(price * quantity, 2)
+        })
+        total += price * quantity
+    
+    return {
+        "transaction_id": str(uuid.uuid4()),
+        "customer_id": str(uuid.uuid4()),
+        "customer_name": faker.name(),
+        "date": faker.date_time_this_month().isoformat(),
+        "products": products,
+        "total_amount": round(total, 2),
+        "payment_method": faker.random_element(elements=("Credit Card", "PayPal", "Bank Transfer", "Cash")),
+        "status": faker.random_element(elements=("completed", "pending", "failed", "refunded")),
+        "shipping_address": {
+            "street": faker.street_address(),
+            "city": faker.city(),
+            "state": faker.state(),
+            "country": faker.country(),
+            "zipcode": faker.zipcode()
+        }
+    }
+
+def fake_review(faker) -> dict:
+    """A fake product review."""
+    return {
+        "review_id": str(uuid.uuid4()),
+        "product_id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "username": faker.user_name(),
+        "rating": faker.random_int(min=1, max=5),
+        "title": faker.sentence(nb_words=6),
+        "content": faker.paragraph(nb_sentences=4),
+        "pros": [faker.sentence(nb_words=4) for _ in range(faker.random_int(min=1, max=3))],
+        "cons": [faker.sentence(nb_words=4) for _ in range(faker.random_int(min=0, max=3))],
+        "verified_purchase": faker.boolean(chance_of_getting_true=70),
+        "helpful_votes": faker.random_int(min=0, max=100),
+        "date_posted": faker.date_time_this_year().isoformat(),
+        "images": [faker.image_url() for _ in range(faker.random_int(min=0, max=3))]
+    }
+
+# Pools of pre-generated records for the slowest /demo/generate-* routes,
+# refilled on background threads that each use their own Faker
+demo_pool_executor = ThreadPoolExecutor(
+    max_workers=DEMO_POOL_REFILL_WORKERS, thread_name_prefix="demo-pool"
+)
+profile_pool, transaction_pool, review_pool = (
+    RecordPool(generate, DEMO_POOL_SIZE, DEMO_POOL_LOW_WATER, demo_pool_executor, new_faker, fake)
+    for generate in (fake_profile, fake_transaction, fake_review)
+)
+
 # --- Routes ---
 
-@app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
+@app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED,
+          dependencies=[Depends(admit_auth_request)])
 async def register(user: UserRegister):
     """Register a new user."""
-    if user.username in users_db:
+    check_username_rate(user.username)
+    if await run_storage(users_db.__contains__, user.username):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
@@ -158,14 +904,20 @@ async def register(user: UserRegister):
     
     # Create user object
     user_id = str(uuid.uuid4())
-    hashed_password = hash_password(user.password.get_secret_value())
+    hashed_password = await run_password_hash(hash_password, user.password.get_secret_value())
     
-    users_db[user.username] = {
+    added = await run_storage(users_db.add, {
         "email": user.email,
         "username": user.username,
         "hashed_password": hashed_password,
         "user_id": user_id
-    }
+    })
+    # The username may have been taken while the password was hashing
+    if not added:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
     
     return {
         "email": user.email,
@@ -173,10 +925,11 @@ async def register(user: UserRegister):
         "user_id": user_id
     }
 
-@app.post("/token", response_model=Token)
+@app.post("/token", response_model=Token, dependencies=[Depends(admit_auth_request)])
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Login to get an access token."""
-    user = get_user(form_data.username)
+    check_username_rate(form_data.username)
+    user = await get_user(form_data.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -184,196 +937,807 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not verify_password(user["hashed_password"], form_data.password):
+    valid, new_hash = await run_password_hash(
+        verify_and_update_password, user["hashed_password"], form_data.password
+    )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Transparently upgrade legacy or outdated password hashes
+    if new_hash is not None:
+        await run_storage(users_db.update_password, user["username"], new_hash)
+    
     # Generate token
-    token = secrets.token_urlsafe(32)
-    tokens_db[token] = user["username"]
+    if TOKEN_MODE == "signed":
+        token = create_signed_token(user["username"])
+    else:
+        token = secrets.token_urlsafe(32)
+        await run_storage(tokens_db.issue, token, user["username"])
     
-    return {"access_token": token, "token_type": "bearer"}
+    return {"access_token": token, "token_type": "bearer", "expires_in": TOKEN_TTL_SECONDS}
 
-@app.post("/payments", response_model=PaymentResponse)
-async def process_payment(
-    payment: PaymentRequest, 
+@app.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    token: str = Depends(oauth2_scheme),
     user: dict = Depends(get_current_user)
 ):
-    """Process a credit card payment."""
+    """Revoke the access token used for this request."""
+    if TOKEN_MODE == "signed":
+        claims = decode_signed_token(token)
+        await run_storage(revoked_tokens.issue, claims["jti"], claims["sub"],
+                          max(0, claims["exp"] - int(time.time())))
+    else:
+        await run_storage(tokens_db.revoke, token)
+
+def build_payment_record(payment: PaymentRequest, user: dict) -> dict:
+    """Build the stored record for a validated payment request."""
     # Get the credit card details
     card = payment.credit_card
     
     # In a real system, you'd integrate with a payment processor
-    # This is just a simulation
+    # This is just a simulation, inline or through payment_pipeline
     
     # SECURITY RISK: Store full card information (intentionally insecure)
-    payment_id = str(uuid.uuid4())
     card_number = card.card_number
-    last_four = card_number[-4:]
     
     # Save payment info with full card details (extremely insecure)
-    payments_db[payment_id] = {
-        "payment_id": payment_id,
+    return {
+        "payment_id": str(uuid.uuid4()),
         "user_id": user["user_id"],
         "full_card_number": card_number,  # SECURITY RISK: Storing full card numbers
-        "card_last_four": last_four,
+        "card_last_four": card_number[-4:],
         "card_holder": card.cardholder_name,
         "expiry_month": card.expiry_month,
         "expiry_year": card.expiry_year,
         "cvv": card.cvv.get_secret_value(),  # SECURITY RISK: Storing CVV
         "amount": payment.amount,
-        "status": "completed",
+        "status": "completed" if payment_pipeline is None else "pending",
         "timestamp": datetime.now(),
         "description": payment.description
     }
-    
-    # SECURITY RISK: The response includes the full card data in the logs
+
+def payment_response(record: dict) -> dict:
+    """The PaymentResponse fields of a stored payment record."""
     return {
-        "payment_id": payment_id,
-        "card_last_four": last_four,  # Still only showing last four in the response model
-        "amount": payment.amount,
-        "status": "completed",
-        "timestamp": datetime.now()
+        "payment_id": record["payment_id"],
+        "card_last_four": record["card_last_four"],  # Still only showing last four in the response model
+        "amount": record["amount"],
+        "status": record["status"],
+        "timestamp": record["timestamp"]
     }
 
+async def store_payments(records: List[dict]):
+    """Store new payment records and, in pipeline mode, queue them for the processor."""
+    if payment_pipeline is None:
+        await run_storage(payments_db.add_many, records)
+        return
+    # Checked before storing, so a rejected request leaves nothing pending
+    if payment_pipeline.free() < len(records):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many payments awaiting processing; retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    # Held while the records are stored, so other requests cannot take the room
+    payment_pipeline.reserve(len(records))
+    try:
+        await run_storage(payments_db.add_many, records)
+    finally:
+        payment_pipeline.release(len(records))
+    payment_pipeline.submit(records)
+
+@app.post("/payments", response_model=PaymentResponse)
+async def process_payment(
+    payment: PaymentRequest, 
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[tuple] = Depends(claim_idempotency_key)
+):
+    """
+    Process a credit card payment.
+    
+    Retries that repeat the Idempotency-Key header get the first response
+    back instead of creating another payment. In pipeline mode the payment
+    is returned as pending; GET /payments/{payment_id} reports its outcome.
+    """
+    record = build_payment_record(payment, user)
+    await store_payments([record])
+    
+    # SECURITY RISK: The response includes the full card data in the logs
+    content = payment_response(record)
+    if idempotency_key is not None:
+        idempotency_cache.set(idempotency_key, content)
+    return fast_response(content)
+
+@app.post("/payments/batch", response_model=List[BatchPaymentResult])
+async def process_payment_batch(
+    items: List[dict] = Body(...),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Process many payments in one request.
+    
+    Every item is validated on its own. Valid items are stored together and
+    invalid ones are reported with their errors, so one bad item does not
+    fail the rest of the batch.
+    """
+    # A batch larger than the pipeline's queue could never be accepted
+    max_size = PAYMENT_BATCH_MAX_SIZE if payment_pipeline is None else min(
+        PAYMENT_BATCH_MAX_SIZE, payment_pipeline.queue_size)
+    if len(items) > max_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {max_size} payments"
+        )
+    
+    results = []
+    records = []
+    for index, item in enumerate(items):
+        try:
+            payment = PaymentRequest(**item)
+        except ValidationError as e:
+            results.append({
+                "index": index,
+                "success": False,
+                "errors": [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]
+            })
+            continue
+        record = build_payment_record(payment, user)
+        records.append(record)
+        results.append({"index": index, "success": True, "payment": payment_response(record)})
+    
+    await store_payments(records)
+    return fast_response(results)
+
+def payment_pages(fetch, after, limit: Optional[int] = None, render=None):
+    """
+    Yield payments from fetch(size, after) after the given key in chunks,
+    up to limit in total, each rendered with render (payment_response by default).
+    """
+    render = render or payment_response
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining)
+        page = fetch(size, after)
+        if page:
+            yield [render(payment) for payment in page]
+        if len(page) < size:
+            return
+        if remaining is not None:
+            remaining -= len(page)
+        after = (page[-1]["timestamp"], page[-1]["payment_id"])
+
 @app.get("/payments", response_model=List[PaymentResponse])
-async def get_payments(user: dict = Depends(get_current_user)):
-    """Get all payments for the current user."""
-    user_payments = [
-        {
-            "payment_id": payment["payment_id"],
-            "card_last_four": payment["card_last_four"],
-            "amount": payment["amount"],
-            "status": payment["status"],
-            "timestamp": payment["timestamp"]
-        }
-        for payment_id, payment in payments_db.items()
-        if payment["user_id"] == user["user_id"]
-    ]
+async def get_payments(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=PAYMENTS_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Get one page of payments for the current user, oldest first, optionally
+    only those with since <= timestamp < until.
+
+    When more payments remain, the X-Next-Cursor response header carries the
+    cursor to pass back for the next page. With Accept: application/x-ndjson
+    the payments after the cursor are streamed instead, all of them unless a
+    limit is given.
     
-    return user_payments
+    Pages carry an ETag that changes whenever the user's payments do; a
+    request whose If-None-Match still matches gets 304 without the payments
+    being read. Serialized pages are cached for repeat polls.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    since, until = to_naive(since), to_naive(until)
+    
+    def fetch(size, after):
+        return payments_db.list_for_user(user["user_id"], size, after, since, until)
+    
+    if wants_ndjson(request):
+        return ndjson_response(payment_pages(fetch, after, limit))
+    
+    # Read before the page, so a page is never cached under a newer version
+    version = await run_storage(payments_db.version, user["user_id"])
+    etag = f'"{PAYMENTS_ETAG_PREFIX}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    limit = limit or PAYMENTS_PAGE_DEFAULT_LIMIT
+    cache_key = (user["user_id"], limit, after, since, until)
+    cached = payments_page_cache.get(cache_key)
+    if cached is not None and cached[0] == version:
+        _, body, next_cursor = cached
+    else:
+        # Fetch one extra row to learn whether another page follows
+        page = await run_storage(fetch, limit + 1, after)
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last = page[-1]
+            next_cursor = encode_cursor((last["timestamp"], last["payment_id"]))
+        body = dump_json([payment_response(payment) for payment in page])
+        # Replaces the entry for an older version rather than adding one
+        payments_page_cache.set(cache_key, (version, body, next_cursor), len(body))
+    
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/payments/summary", response_model=PaymentSummary)
+async def get_payment_summary(user: dict = Depends(get_current_user)):
+    """Get payment counts and totals per status and per day for the current user."""
+    return fast_response(await run_storage(payments_db.summary, user["user_id"]))
+
+@app.get("/payments/{payment_id}", response_model=PaymentResponse)
+async def get_payment(payment_id: str, user: dict = Depends(get_current_user)):
+    """Get one of the current user's payments, e.g. to poll a pending payment's status."""
+    record = await run_storage(payments_db.get, payment_id)
+    if record is None or record["user_id"] != user["user_id"]:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found")
+    return fast_response(payment_response(record))
 
 # Add new routes for generating fake data
 
-@app.get("/demo/generate-user")
+@demo.get("/demo/generate-user")
 def generate_fake_user():
     """Generate a fake user for testing."""
-    return {
+    return fast_response({
         "username": fake.user_name(),
         "email": fake.email(),
         "password": fake.password(length=12, special_chars=True, digits=True, upper_case=True, lower_case=True),
         "name": fake.name(),
         "address": fake.address()
-    }
+    })
 
-@app.get("/demo/generate-credit-card")
+@demo.get("/demo/generate-credit-card")
 def generate_fake_credit_card():
     """Generate a fake credit card for testing."""
-    return {
+    return fast_response({
         "card_number": fake.credit_card_number(),
         "card_type": fake.credit_card_provider(),
         "expiry_date": fake.credit_card_expire(),
         "cvv": fake.credit_card_security_code(),
         "holder_name": fake.name()
-    }
+    })
 
-@app.get("/demo/generate-payment")
+@demo.get("/demo/generate-payment")
 def generate_fake_payment():
     """Generate a fake payment for testing."""
-    return {
+    return fast_response({
         "payment_id": str(uuid.uuid4()),
         "amount": round(float(fake.random_number(digits=3) + fake.random_number(digits=2)/100), 2),
         "card_last_four": fake.credit_card_number()[-4:],
         "status": fake.random_element(elements=("completed", "pending", "failed")),
         "timestamp": fake.date_time_this_month(),
         "description": fake.text(max_nb_chars=100)
-    }
+    })
 
-@app.post("/demo/create-fake-users", response_model=List[UserResponse])
-def create_fake_users(count: int = 5):
-    """Create multiple fake users in the database."""
-    created_users = []
-    
+def new_fake_users(count: int) -> List[dict]:
+    """Generate count fake users with unused usernames and plain-text passwords."""
+    new_users = {}
     for _ in range(count):
         username = fake.user_name()
-        while username in users_db:
+        while username in users_db or username in new_users:
             username = fake.user_name()
-            
-        email = fake.email()
-        password = fake.password(length=12, special_chars=True, digits=True, upper_case=True, lower_case=True)
         
-        # Create user object
-        user_id = str(uuid.uuid4())
-        hashed_password = hash_password(password)
-        
-        users_db[username] = {
-            "email": email,
+        new_users[username] = {
+            "email": fake.email(),
             "username": username,
-            "hashed_password": hashed_password,
-            "user_id": user_id
+            "password": fake.password(length=12, special_chars=True, digits=True, upper_case=True, lower_case=True)
         }
+    return list(new_users.values())
+
+async def fake_user_batches(count: int):
+    """Create count fake users, yielding the UserResponse dicts of each inserted batch."""
+    loop = asyncio.get_running_loop()
+    for start in range(0, count, STREAM_CHUNK_SIZE):
+        generated = await loop.run_in_executor(None, new_fake_users, min(STREAM_CHUNK_SIZE, count - start))
+        hashed = await run_bulk_password_hash([user["password"] for user in generated])
+        new_users = [
+            {
+                "email": user["email"],
+                "username": user["username"],
+                "hashed_password": hashed_password,
+                "user_id": str(uuid.uuid4())
+            }
+            for user, hashed_password in zip(generated, hashed)
+        ]
         
-        created_users.append({
-            "email": email,
-            "username": username,
-            "user_id": user_id
-        })
+        # Insert in one batch; skip any username registered in the meantime
+        added = await loop.run_in_executor(None, users_db.add_many, new_users)
+        yield [
+            {"email": user["email"], "username": user["username"], "user_id": user["user_id"]}
+            for user, ok in zip(new_users, added) if ok
+        ]
+
+@demo.post("/demo/create-fake-users", response_model=List[UserResponse])
+async def create_fake_users(request: Request, count: int = Query(5, ge=1, le=DEMO_CREATE_MAX_COUNT)):
+    """
+    Create multiple fake users in the database.
+    
+    Passwords are hashed on the password hash threads, a batch at a time,
+    alongside /register and /token. With Accept: application/x-ndjson users
+    are streamed back batch by batch as they are inserted.
+    """
+    batches = fake_user_batches(count)
+    if wants_ndjson(request):
+        return ndjson_response(batches)
+    return fast_response([user async for batch in batches for user in batch])
+
+# --- Bulk user import ---
+
+CSV_MEDIA_TYPE = "text/csv"
+IMPORT_RESULTS_CHUNK = 64 * 1024
+DUPLICATE_USERNAME_ERROR = {"loc": ["username"], "msg": "Username already registered"}
+
+class ImportAborted(Exception):
+    """The upload cannot be read any further."""
+
+class ResultSpool:
+    """
+    Bytes written by one task and streamed out by another through an
+    unnamed temporary file, so the writer never waits on a slow reader and
+    neither side holds more than a chunk in memory.
+    """
+    
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._written = 0
+        self._changed = asyncio.Event()
+        self.finished = False
+    
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        self._written += len(data)
+        self._changed.set()
+    
+    def finish(self):
+        """Mark the end of the data; read() stops once it has yielded all of it."""
+        self.finished = True
+        self._changed.set()
+    
+    async def read(self) -> AsyncIterator[bytes]:
+        sent = 0
+        while True:
+            while sent < self._written:
+                chunk = os.pread(self._file.fileno(), min(IMPORT_RESULTS_CHUNK, self._written - sent), sent)
+                sent += len(chunk)
+                yield chunk
+            if self.finished:
+                return
+            await self._changed.wait()
+            self._changed.clear()
+    
+    def close(self):
+        self._file.close()
+
+class UploadStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse whose body iterator reads the request body. The
+    stock one listens for a disconnect on receive() while streaming, which
+    would take the upload's messages; reading the body notices a disconnect
+    anyway (as ClientDisconnect).
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+async def upload_lines(request: Request) -> AsyncIterator[bytes]:
+    """
+    Yield the request body's lines, without line endings, as they arrive.
+    Only the current partial line is held between chunks.
+    """
+    pending = b""
+    async for chunk in request.stream():
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        if len(pending) > USER_IMPORT_MAX_ROW_BYTES:
+            raise ImportAborted(f"A row is longer than {USER_IMPORT_MAX_ROW_BYTES} bytes")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+async def ndjson_rows(lines: AsyncIterator[bytes]) -> AsyncIterator[tuple]:
+    """Yield (row number, object or error message) for each non-blank line."""
+    number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, "Invalid JSON"
+            continue
+        yield number, row if isinstance(row, dict) else "Each line must be a JSON object"
+
+async def csv_rows(lines: AsyncIterator[bytes]) -> AsyncIterator[tuple]:
+    """
+    Yield (row number, dict or error message) for each record after the
+    header row. A quoted field may span lines.
+    """
+    header = None
+    number = 0
+    record = ""
+    async for line in lines:
+        text = line.decode("utf-8-sig" if header is None and not record else "utf-8", errors="replace")
+        record = f"{record}\n{text}" if record else text
+        if record.count('"') % 2:
+            # Inside a quoted field that continues on the next line
+            if len(record) > USER_IMPORT_MAX_ROW_BYTES:
+                raise ImportAborted(f"A row is longer than {USER_IMPORT_MAX_ROW_BYTES} bytes")
+            continue
+        fields, record = next(csv.reader([record]), []), ""
+        if not any(field.strip() for field in fields):
+            continue
+        if header is None:
+            header = [field.strip() for field in fields]
+            continue
+        number += 1
+        if len(fields) != len(header):
+            yield number, f"Expected {len(header)} columns, got {len(fields)}"
+        else:
+            yield number, dict(zip(header, fields))
+    if record:
+        raise ImportAborted("The upload ends inside a quoted field")
+
+def existing_usernames(usernames: List[str]) -> set:
+    return {username for username in usernames if username in users_db}
+
+async def import_user_batch(rows: List[tuple]) -> List[dict]:
+    """
+    Validate, hash and insert one batch of rows, returning a result per row
+    in upload order. Usernames repeated within the batch or already
+    registered are reported as duplicates.
+    """
+    results = []
+    accepted = []
+    seen = set()
+    for number, row in rows:
+        result = {"row": number, "success": False}
+        results.append(result)
+        if isinstance(row, str):
+            result["errors"] = [{"loc": [], "msg": row}]
+            continue
+        try:
+            user = UserRegister(**row)
+        except ValidationError as e:
+            result["errors"] = [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]
+            continue
+        if user.username in seen:
+            result["errors"] = [DUPLICATE_USERNAME_ERROR]
+            continue
+        seen.add(user.username)
+        accepted.append((result, user))
+    
+    # Check before hashing, so duplicates cost no hashing time
+    loop = asyncio.get_running_loop()
+    taken = await loop.run_in_executor(None, existing_usernames, list(seen))
+    for result, user in accepted:
+        if user.username in taken:
+            result["errors"] = [DUPLICATE_USERNAME_ERROR]
+    accepted = [(result, user) for result, user in accepted if user.username not in taken]
+    
+    hashed = await run_bulk_password_hash([user.password.get_secret_value() for _, user in accepted])
+    records = [
+        {"email": user.email, "username": user.username, "hashed_password": hashed_password,
+         "user_id": str(uuid.uuid4())}
+        for (_, user), hashed_password in zip(accepted, hashed)
+    ]
+    added = await loop.run_in_executor(None, users_db.add_many, records)
+    for (result, _), record, was_added in zip(accepted, records, added):
+        # The username may have been taken while the passwords were hashing
+        if not was_added:
+            result["errors"] = [DUPLICATE_USERNAME_ERROR]
+            continue
+        result["success"] = True
+        result["user"] = {key: record[key] for key in ("email", "username", "user_id")}
+    return results
+
+@app.post("/admin/import-users", dependencies=[Depends(require_admin)])
+async def import_users(request: Request, errors_only: bool = Query(False)):
+    """
+    Import users from a streamed upload: NDJSON with one {"email",
+    "username", "password"} object per line, or with Content-Type text/csv,
+    CSV with a header row naming those columns. Rows follow the same rules
+    as /register. The X-Admin-Password header is checked before any of the
+    body is read.
+    
+    The body is parsed as it arrives and handled USER_IMPORT_BATCH_SIZE rows
+    at a time, so memory does not grow with the upload. Results stream back
+    as NDJSON after each batch, one {"row", "success", "user" | "errors"}
+    line per row (only failed rows with errors_only=true), and the last line
+    is {"summary": {...}}. Results are spooled to a temporary file, so
+    clients that only read the response once their upload is sent work too.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    lines = upload_lines(request)
+    rows = csv_rows(lines) if content_type == CSV_MEDIA_TYPE else ndjson_rows(lines)
+    
+    async def run_import(spool: ResultSpool):
+        summary = {"rows": 0, "imported": 0, "failed": 0}
+        batch = []
+        
+        async def flush():
+            batch_results = await import_user_batch(batch)
+            batch.clear()
+            imported = sum(result["success"] for result in batch_results)
+            summary["rows"] += len(batch_results)
+            summary["imported"] += imported
+            summary["failed"] += len(batch_results) - imported
+            if errors_only:
+                batch_results = [result for result in batch_results if not result["success"]]
+            spool.write(b"".join(dump_json(result) + b"\n" for result in batch_results))
+        
+        try:
+            async for row in rows:
+                batch.append(row)
+                if len(batch) >= USER_IMPORT_BATCH_SIZE:
+                    await flush()
+        except ImportAborted as e:
+            summary["error"] = str(e)
+        except ClientDisconnect:
+            return
+        if batch:
+            await flush()
+        spool.write(dump_json({"summary": summary}) + b"\n")
     
-    return created_users
+    async def results():
+        spool = ResultSpool()
+        # Runs as its own task so the upload keeps being read while the
+        # response waits on the client
+        task = asyncio.create_task(run_import(spool))
+        task.add_done_callback(lambda _: spool.finish())
+        try:
+            async for chunk in spool.read():
+                yield chunk
+            await task
+        finally:
+            task.cancel()
+            spool.close()
+    
+    return UploadStreamingResponse(results(), media_type=NDJSON_MEDIA_TYPE)
+
+# --- Admin commands ---
+
+COMMAND_READ_CHUNK = 64 * 1024
+COMMAND_JOBS_KEPT = 100
+commands_running = 0
+command_jobs = {}
+
+def claim_command_slot():
+    """Count a command against COMMAND_MAX_CONCURRENCY, or 503 if none is free."""
+    global commands_running
+    if commands_running >= COMMAND_MAX_CONCURRENCY:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many commands running, please retry",
+            headers={"Retry-After": "1"},
+        )
+    commands_running += 1
+
+def release_command_slot():
+    global commands_running
+    commands_running -= 1
+
+def kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def run_command(command: str, timeout: float, on_output) -> int:
+    """
+    Run a shell command in its own process group, awaiting on_output(stream,
+    data) for each chunk read from stdout or stderr. On timeout or
+    cancellation the whole group is killed, so commands the shell started
+    die with it, and the exception propagates. Returns the exit code.
+    """
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+
+    async def pump(reader, stream):
+        while True:
+            data = await reader.read(COMMAND_READ_CHUNK)
+            if not data:
+                return
+            await on_output(stream, data)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(pump(process.stdout, "stdout"), pump(process.stderr, "stderr"), process.wait()),
+            timeout
+        )
+    except BaseException:
+        kill_process_group(process)
+        await process.wait()
+        raise
+    return process.returncode
+
+class CommandJob:
+    """
+    A background command and its output so far. Output is kept (up to
+    COMMAND_JOB_OUTPUT_LIMIT bytes) so a follower that connects late still
+    streams it from the start; changed wakes followers on new output.
+    """
+
+    def __init__(self, command: str):
+        self.job_id = str(uuid.uuid4())
+        self.command = command
+        self.status = "running"
+        self.return_code = None
+        self.error = None
+        self.chunks = []  # (stream, text)
+        self.output_bytes = 0
+        self.truncated = False
+        self.changed = asyncio.Condition()
+        self.task = None
+        self._decoders = {
+            stream: codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for stream in ("stdout", "stderr")
+        }
+
+    async def append(self, stream: str, data: bytes):
+        if self.truncated:
+            return
+        # Keep what fits and nothing after it, so the output has no gaps
+        room = COMMAND_JOB_OUTPUT_LIMIT - self.output_bytes
+        if len(data) > room:
+            data, self.truncated = data[:room], True
+        self.output_bytes += len(data)
+        text = self._decoders[stream].decode(data)
+        if text:
+            async with self.changed:
+                self.chunks.append((stream, text))
+                self.changed.notify_all()
+
+    async def finish(self, job_status: str, return_code: Optional[int] = None, error: Optional[str] = None):
+        async with self.changed:
+            # Output ending in an incomplete UTF-8 sequence is still held by the decoder
+            for stream, decoder in self._decoders.items():
+                text = decoder.decode(b"", final=True)
+                if text:
+                    self.chunks.append((stream, text))
+            self.status, self.return_code, self.error = job_status, return_code, error
+            self.changed.notify_all()
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "command": self.command,
+            "status": self.status,
+            "return_code": self.return_code,
+            "error": self.error,
+            "output_bytes": self.output_bytes,
+            "truncated": self.truncated
+        }
+
+async def run_command_job(job: CommandJob):
+    """Run a background job's command to completion, then free its slot."""
+    try:
+        return_code = await run_command(job.command, COMMAND_JOB_TIMEOUT_SECONDS, job.append)
+        await job.finish("completed", return_code)
+    except asyncio.TimeoutError:
+        await job.finish("timed_out", error=f"Command timed out after {COMMAND_JOB_TIMEOUT_SECONDS:g} seconds")
+    except asyncio.CancelledError:
+        await job.finish("cancelled")
+        raise
+    except Exception as e:
+        await job.finish("failed", error=str(e))
+    finally:
+        release_command_slot()
+
+def get_command_job(job_id: str) -> CommandJob:
+    job = command_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
 
 @app.post("/admin/execute-command")
 async def execute_shell_command(request: ShellCommandRequest):
     """
     WARNING: This endpoint allows shell command execution and should NEVER be used in production.
     It is provided only for demonstration/testing purposes in controlled environments.
+    
+    Commands run as asyncio subprocesses, so the event loop keeps serving
+    other requests meanwhile. With "background": true the command runs as a
+    job and its id is returned at once.
     """
-    # Hardcoded password - in a real scenario, use a much stronger authentication mechanism
-    # and preferably environment variables rather than hardcoded values
-    ADMIN_PASSWORD = "super_secret_admin_password_123!"
+    check_admin_password(request.password)
     
-    if request.password != ADMIN_PASSWORD:
-        # Use a generic error message to avoid leaking information
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication failed"
-        )
+    claim_command_slot()
+    
+    if request.background:
+        job = CommandJob(request.command)
+        job.task = asyncio.create_task(run_command_job(job))
+        command_jobs[job.job_id] = job
+        if len(command_jobs) > COMMAND_JOBS_KEPT:
+            # Forget the oldest finished job
+            for job_id, old in command_jobs.items():
+                if old.status != "running":
+                    del command_jobs[job_id]
+                    break
+        return JSONResponse(job.as_dict(), status_code=status.HTTP_202_ACCEPTED)
+    
+    output = {"stdout": [], "stderr": []}
+    
+    async def collect(stream, data):
+        output[stream].append(data)
     
     try:
         # Execute the command with shell=True to allow shell features
         # WARNING: This is extremely dangerous in production environments
-        result = subprocess.run(
-            request.command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=30  # Limit execution time to 30 seconds
-        )
+        return_code = await run_command(request.command, COMMAND_TIMEOUT_SECONDS, collect)
         
         return {
             "success": True,
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "return_code": result.returncode
+            "stdout": b"".join(output["stdout"]).decode(errors="replace"),
+            "stderr": b"".join(output["stderr"]).decode(errors="replace"),
+            "return_code": return_code
         }
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         raise HTTPException(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
-            detail="Command execution timed out after 30 seconds"
+            detail=f"Command execution timed out after {COMMAND_TIMEOUT_SECONDS:g} seconds"
         )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Command execution failed: {str(e)}"
         )
+    finally:
+        release_command_slot()
+
+@app.get("/admin/command-jobs/{job_id}", dependencies=[Depends(require_admin)])
+async def get_command_job_status(job_id: str):
+    """Report a background command's status."""
+    return get_command_job(job_id).as_dict()
+
+@app.get("/admin/command-jobs/{job_id}/output", dependencies=[Depends(require_admin)])
+async def stream_command_job_output(job_id: str):
+    """
+    Stream a background command's output as NDJSON, one
+    {"stream": "stdout"|"stderr", "data": ...} line per chunk as it is
+    produced, from the start of the output. The last line is the job's
+    final status.
+    """
+    job = get_command_job(job_id)
+    
+    async def follow():
+        sent = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(lambda: len(job.chunks) > sent or job.status != "running")
+                chunks = job.chunks[sent:]
+                done = job.status != "running"
+            sent += len(chunks)
+            if chunks:
+                yield b"".join(dump_json({"stream": stream, "data": data}) + b"\n" for stream, data in chunks)
+            if done:
+                yield dump_json(job.as_dict()) + b"\n"
+                return
+    
+    return StreamingResponse(follow(), media_type=NDJSON_MEDIA_TYPE)
 
 # New fake data routes
-@app.get("/demo/generate-address")
+@demo.get("/demo/generate-address")
 def generate_fake_address():
     """Generate a fake address for testing."""
-    return {
+    return fast_response({
         "street": fake.street_address(),
         "city": fake.city(),
         "state": fake.state(),
@@ -381,37 +1745,17 @@ def generate_fake_address():
         "zip_code": fake.zipcode(),
         "latitude": float(fake.latitude()),
         "longitude": float(fake.longitude())
-    }
+    })
 
-@app.get("/demo/generate-profile")
+@demo.get("/demo/generate-profile")
 def generate_fake_profile():
     """Generate a complete fake user profile for testing."""
-    return {
-        "id": str(uuid.uuid4()),
-        "username": fake.user_name(),
-        "email": fake.email(),
-        "name": fake.name(),
-        "birthdate": fake.date_of_birth(minimum_age=18, maximum_age=90).isoformat(),
-        "phone_number": fake.phone_number(),
-        "job": fake.job(),
-        "company": fake.company(),
-        "address": {
-            "street": fake.street_address(),
-            "city": fake.city(),
-            "state": fake.state(),
-            "country": fake.country(),
-            "zipcode": fake.zipcode()
-        },
-        "website": fake.url(),
-        "profile_picture": fake.image_url(),
-        "bio": fake.paragraph(nb_sentences=3),
-        "registration_date": fake.date_time_this_year().isoformat()
-    }
+    return fast_response(profile_pool.take())
 
-@app.get("/demo/generate-product")
+@demo.get("/demo/generate-product")
 def generate_fake_product():
     """Generate a fake product for testing."""
-    return {
+    return fast_response({
         "id": str(uuid.uuid4()),
         "name": fake.catch_phrase(),
         "description": fake.paragraph(nb_sentences=5),
@@ -423,133 +1767,150 @@ def generate_fake_product():
         "image_url": fake.image_url(),
         "created_at": fake.date_time_this_year().isoformat(),
         "tags": [fake.word() for _ in range(fake.random_int(min=1, max=5))]
-    }
+    })
 
-@app.get("/demo/generate-transaction")
+@demo.get("/demo/generate-transaction")
 def generate_fake_transaction():
     """Generate a fake transaction for testing."""
-    product_count = fake.random_int(min=1, max=5)
-    products = []
-    total = 0
-    
-    for _ in range(product_count):
-        price = round(float(fake.random_number(digits=2) + fake.random_number(digits=2)/100), 2)
-        quantity = fake.random_int(min=1, max=10)
-        products.append({
-            "product_id": str(uuid.uuid4()),
-            "name": fake.catch_phrase(),
-            "price": price,
-            "quantity": quantity,
-            "subtotal": round(price * quantity, 2)
-        })
-        total += price * quantity
-    
-    return {
-        "transaction_id": str(uuid.uuid4()),
-        "customer_id": str(uuid.uuid4()),
-        "customer_name": fake.name(),
-        "date": fake.date_time_this_month().isoformat(),
-        "products": products,
-        "total_amount": round(total, 2),
-        "payment_method": fake.random_element(elements=("Credit Card", "PayPal", "Bank Transfer", "Cash")),
-        "status": fake.random_element(elements=("completed", "pending", "failed", "refunded")),
-        "shipping_address": {
-            "street": fake.street_address(),
-            "city": fake.city(),
-            "state": fake.state(),
-            "country": fake.country(),
-            "zipcode": fake.zipcode()
-        }
-    }
+    return fast_response(transaction_pool.take())
 
-@app.get("/demo/generate-review")
+@demo.get("/demo/generate-review")
 def generate_fake_review():
     """Generate a fake product review for testing."""
+    return fast_response(review_pool.take())
+
+@demo.get("/demo/pool-stats")
+def get_demo_pool_stats():
+    """Report fill level and hit/miss counters of the fake data pools."""
     return {
-        "review_id": str(uuid.uuid4()),
-        "product_id": str(uuid.uuid4()),
-        "user_id": str(uuid.uuid4()),
-        "username": fake.user_name(),
-        "rating": fake.random_int(min=1, max=5),
-        "title": fake.sentence(nb_words=6),
-        "content": fake.paragraph(nb_sentences=4),
-        "pros": [fake.sentence(nb_words=4) for _ in range(fake.random_int(min=1, max=3))],
-        "cons": [fake.sentence(nb_words=4) for _ in range(fake.random_int(min=0, max=3))],
-        "verified_purchase": fake.boolean(chance_of_getting_true=70),
-        "helpful_votes": fake.random_int(min=0, max=100),
-        "date_posted": fake.date_time_this_year().isoformat(),
-        "images": [fake.image_url() for _ in range(fake.random_int(min=0, max=3))]
+        "profile": profile_pool.stats(),
+        "transaction": transaction_pool.stats(),
+        "review": review_pool.stats()
     }
 
-@app.post("/demo/create-fake-payments", response_model=List[PaymentResponse])
-def create_fake_payments(count: int = 5, user_id: Optional[str] = None):
-    """Create multiple fake payments in the database with full card details."""
-    created_payments = []
+def fake_payment_batches(count: int, user_id: str):
+    """Create count fake payments for a user, yielding the PaymentResponse dicts of each inserted batch."""
+    for start in range(0, count, STREAM_CHUNK_SIZE):
+        new_payments = []
+        
+        for _ in range(min(STREAM_CHUNK_SIZE, count - start)):
+            full_card_number = fake.credit_card_number()
+            
+            # SECURITY RISK: Store complete credit card details
+            new_payments.append({
+                "payment_id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "full_card_number": full_card_number,  # SECURITY RISK
+                "card_last_four": full_card_number[-4:],
+                "card_holder": fake.name(),
+                "expiry_month": fake.random_int(min=1, max=12),
+                "expiry_year": fake.random_int(min=datetime.now().year, max=datetime.now().year + 5),
+                "cvv": fake.credit_card_security_code(),  # SECURITY RISK
+                "amount": round(float(fake.random_number(digits=3) + fake.random_number(digits=2)/100), 2),
+                "status": fake.random_element(elements=("completed", "pending", "failed")),
+                "timestamp": datetime.now() - timedelta(days=fake.random_int(min=0, max=30)),
+                "description": fake.text(max_nb_chars=100)
+            })
+        
+        payments_db.add_many(new_payments)
+        # Only return the standard payment response model
+        yield [payment_response(payment) for payment in new_payments]
+
+@demo.post("/demo/create-fake-payments", response_model=List[PaymentResponse])
+async def create_fake_payments(
+    request: Request,
+    count: int = Query(5, ge=1, le=DEMO_CREATE_MAX_COUNT),
+    user_id: Optional[str] = None
+):
+    """
+    Create multiple fake payments in the database with full card details.
     
+    With Accept: application/x-ndjson payments are streamed back batch by
+    batch as they are inserted.
+    """
+    loop = asyncio.get_running_loop()
     # If no user_id is provided, use a random existing user or create one
-    if not user_id and not users_db:
+    existing_user = None if user_id else await loop.run_in_executor(None, users_db.first)
+    if not user_id and existing_user is None:
         # Create a fake user
         username = fake.user_name()
         email = fake.email()
         password = fake.password(length=12)
         user_id = str(uuid.uuid4())
-        hashed_password = hash_password(password)
+        hashed_password, = await run_bulk_password_hash([password])
         
-        users_db[username] = {
+        await loop.run_in_executor(None, users_db.add, {
             "email": email,
             "username": username,
             "hashed_password": hashed_password,
             "user_id": user_id
-        }
+        })
     elif not user_id:
         # Use a random existing user
-        random_username = list(users_db.keys())[0]
-        user_id = users_db[random_username]["user_id"]
+        user_id = existing_user["user_id"]
     
-    for _ in range(count):
-        payment_id = str(uuid.uuid4())
-        full_card_number = fake.credit_card_number()
-        card_last_four = full_card_number[-4:]
-        amount = round(float(fake.random_number(digits=3) + fake.random_number(digits=2)/100), 2)
-        
-        # SECURITY RISK: Store complete credit card details
-        payment = {
-            "payment_id": payment_id,
-            "user_id": user_id,
-            "full_card_number": full_card_number,  # SECURITY RISK
-            "card_last_four": card_last_four,
-            "card_holder": fake.name(),
-            "expiry_month": fake.random_int(min=1, max=12),
-            "expiry_year": fake.random_int(min=datetime.now().year, max=datetime.now().year + 5),
-            "cvv": fake.credit_card_security_code(),  # SECURITY RISK
-            "amount": amount,
-            "status": fake.random_element(elements=("completed", "pending", "failed")),
-            "timestamp": datetime.now() - timedelta(days=fake.random_int(min=0, max=30)),
-            "description": fake.text(max_nb_chars=100)
-        }
-        
-        payments_db[payment_id] = payment
-        
-        # Only return the standard payment response model
-        created_payments.append({
-            "payment_id": payment_id,
-            "card_last_four": card_last_four,
-            "amount": amount,
-            "status": payment["status"],
-            "timestamp": payment["timestamp"]
-        })
+    batches = fake_payment_batches(count, user_id)
+    if wants_ndjson(request):
+        return ndjson_response(batches)
+    payments = await loop.run_in_executor(None, lambda: [payment for batch in batches for payment in batch])
+    return fast_response(payments)
+
+# Bulk seeding jobs by id, most recent last
+seed_jobs = {}
+SEED_JOBS_KEPT = 100
+
+def run_seed_job(job: dict, request: SeedRequest, hashed_password: str):
+    """Run a bulk seeding job on a background thread, recording progress in job."""
+    try:
+        totals = seed_storage(
+            storage, request.users, request.payments_per_user, hashed_password,
+            seed=request.seed, workers=request.workers, base_time=to_naive(request.base_time),
+            progress=job.update
+        )
+        job.update(totals, status="completed")
+    except Exception as e:
+        job.update(status="failed", error=str(e))
+
+@demo.post("/demo/seed", status_code=status.HTTP_202_ACCEPTED)
+async def start_seed_job(request: SeedRequest):
+    """
+    Start seeding users (named seed_user_<n>, all sharing the given
+    password) and their payments on a process pool. The same seed and
+    base_time always produce the same records. Poll GET /demo/seed/{job_id} for progress.
+    """
+    if any(job["status"] == "running" for job in seed_jobs.values()):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A seeding job is already running"
+        )
+    hashed_password = await run_password_hash(hash_password, request.password)
     
-    return created_payments
+    job_id = str(uuid.uuid4())
+    job = seed_jobs[job_id] = {"job_id": job_id, "status": "running", "users": 0, "payments": 0}
+    while len(seed_jobs) > SEED_JOBS_KEPT:
+        del seed_jobs[next(iter(seed_jobs))]
+    threading.Thread(target=run_seed_job, args=(job, request, hashed_password), daemon=True).start()
+    return job
+
+@demo.get("/demo/seed/{job_id}")
+def get_seed_job(job_id: str):
+    """Report the progress of a bulk seeding job."""
+    if job_id not in seed_jobs:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Seeding job not found"
+        )
+    return seed_jobs[job_id]
 
 # Add a new insecure credit card generating endpoint
-@app.get("/demo/generate-insecure-credit-card")
+@demo.get("/demo/generate-insecure-credit-card")
 def generate_insecure_credit_card():
     """
     WARNING: This endpoint generates and returns full credit card information.
     This is EXTREMELY INSECURE and should NEVER be used in a production environment.
     For demonstration/testing purposes only.
     """
-    return {
+    return fast_response({
         "card_number": fake.credit_card_number(card_type=None),
         "card_type": fake.credit_card_provider(),
         "expiry_date": fake.credit_card_expire(),
@@ -562,7 +1923,7 @@ def generate_insecure_credit_card():
             "zip": fake.zipcode(),
             "country": fake.country()
         }
-    }
+    })
 
 # Add an extremely insecure endpoint to get all credit card data
 @app.get("/admin/all-credit-cards")
@@ -573,10 +1934,10 @@ async def get_all_credit_cards():
     For demonstration/testing purposes only.
     """
     all_cards = []
-    for payment_id, payment in payments_db.items():
+    for payment in await run_storage(list, payments_db.iter_all()):
         if "full_card_number" in payment:
             all_cards.append({
-                "payment_id": payment_id,
+                "payment_id": payment["payment_id"],
                 "user_id": payment["user_id"],
                 "full_card_number": payment["full_card_number"],
                 "card_holder": payment.get("card_holder", "Unknown"),
@@ -588,6 +1949,114 @@ async def get_all_credit_cards():
     
     return all_cards
 
+def admin_payment_response(record: dict) -> dict:
+    """A payment's PaymentResponse fields plus its owner, for reconciliation."""
+    return {**payment_response(record), "user_id": record["user_id"]}
+
+@app.get("/admin/payments", dependencies=[Depends(require_admin)])
+async def get_payments_in_range(
+    request: Request,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PAYMENTS_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = None
+):
+    """
+    Get all users' payments with since <= timestamp < until, oldest first,
+    from the store's timestamp index. Paged and streamed like GET /payments.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    since, until = to_naive(since), to_naive(until)
+    
+    def fetch(size, after):
+        return payments_db.list_range(size, since, until, after)
+    
+    if wants_ndjson(request):
+        return ndjson_response(payment_pages(fetch, after, limit, admin_payment_response))
+    
+    limit = limit or PAYMENTS_PAGE_DEFAULT_LIMIT
+    page = await run_storage(fetch, limit + 1, after)
+    headers = {}
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        headers["X-Next-Cursor"] = encode_cursor((last["timestamp"], last["payment_id"]))
+    
+    return FastJSONResponse([admin_payment_response(payment) for payment in page], headers=headers)
+
+@app.post("/admin/snapshot", dependencies=[Depends(require_admin)])
+async def take_snapshot():
+    """Snapshot the memory backend now instead of waiting for the next interval."""
+    if persistence is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Persistence is not enabled (set PERSIST_DIR with the memory backend)"
+        )
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, persistence.snapshot)
+    return persistence.stats()
+
+@app.get("/admin/payment-pipeline")
+async def get_payment_pipeline_stats():
+    """Report the payment pipeline's queue depth, batching and outcomes."""
+    if payment_pipeline is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The payment pipeline is not enabled (set PAYMENT_MODE=pipeline)"
+        )
+    return payment_pipeline.stats()
+
+@app.get("/admin/cache-stats")
+async def get_cache_stats():
+    """Report the size and hit counters of the in-process caches."""
+    return {
+        "payments_pages": payments_page_cache.stats(),
+        "idempotency": idempotency_cache.stats()
+    }
+
+@app.get("/admin/auth-limits")
+async def get_auth_limit_stats():
+    """Report the auth admission limiters' sizes and rejection counts."""
+    return {
+        "enabled": AUTH_ADMISSION_ENABLED,
+        "username": username_limiter.stats(),
+        "client_ip": client_ip_limiter.stats(),
+        "in_flight": auth_in_flight,
+        "max_concurrency": AUTH_MAX_CONCURRENCY,
+        "concurrency_rejections": auth_concurrency_rejections
+    }
+
+@app.get("/admin/token-stats")
+async def get_token_stats():
+    """Report the size and eviction counters of the token store."""
+    return await run_storage(tokens_db.stats)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request and store metrics in the Prometheus text format."""
+    # Request metrics are only touched on the event loop, so render them here
+    requests = metrics.render()
+    gauges = await asyncio.get_running_loop().run_in_executor(None, metrics.render_gauges)
+    return PlainTextResponse(requests + gauges, media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/profile", response_class=PlainTextResponse)
+async def profile_stacks(
+    seconds: float = Query(10, gt=0, le=PROFILER_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000)
+):
+    """
+    Sample every thread's stack for a time window and return the counts as
+    folded stacks, for flamegraph.pl or speedscope. Off unless PROFILER_ENABLED=1.
+    """
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    loop = asyncio.get_running_loop()
+    try:
+        stacks = await loop.run_in_executor(None, profiler.profile, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return PlainTextResponse(render_folded(stacks))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,215 @@
+"""
+Request metrics in Prometheus text format, and a sampling profiler.
+"""
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Dict, Tuple
+
+from starlette.routing import Match
+
+from cache import LRUCache
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label for requests that match no route, so unknown paths cannot grow the label set
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts are per bucket and summed when rendered."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """
+    Request counts, in-flight gauges and latency histograms by route
+    template, method and status, plus gauges read from callbacks at scrape
+    time.
+
+    Updated only from the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.gauges: Dict[str, Tuple[str, str, Dict[str, Callable[[], float]]]] = {}
+
+    def add_gauge(self, name: str, help_text: str, label: str,
+                  samples: Dict[str, Callable[[], float]]):
+        """Register a gauge read at scrape time, one sample per value of label."""
+        self.gauges[name] = (help_text, label, samples)
+
+    def started(self, route: str, method: str):
+        key = (route, method)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+    def finished(self, route: str, method: str, status: int, seconds: float):
+        self.in_flight[(route, method)] -= 1
+        key = (route, method, str(status))
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram(len(self.buckets))
+        histogram.counts[bisect_left(self.buckets, seconds)] += 1
+        histogram.sum += seconds
+        histogram.count += 1
+
+    def render(self) -> str:
+        """Request metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP http_requests_total Requests handled, by route, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        requests = sorted(self.requests.items())
+        for (route, method, status), histogram in requests:
+            lines.append(f'http_requests_total{{route="{_escape(route)}",method="{method}",'
+                         f'status="{status}"}} {histogram.count}')
+
+        lines += [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for (route, method), count in sorted(self.in_flight.items()):
+            lines.append(f'http_requests_in_flight{{route="{_escape(route)}",method="{method}"}} '
+                         f'{count}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency, including streamed bodies.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        for (route, method, status), histogram in requests:
+            labels = f'route="{_escape(route)}",method="{method}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def render_gauges(self) -> str:
+        """
+        Callback gauges in the Prometheus text exposition format. Callbacks
+        may block (e.g. a COUNT(*) on SQLite), so call this off the event loop.
+        """
+        lines = []
+        for name, (help_text, label, samples) in self.gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for value, read in samples.items():
+                lines.append(f'{name}{{{label}="{value}"}} {read()}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording each HTTP request in metrics.
+
+    Requests are labelled with the template of the route they match (e.g.
+    /demo/seed/{job_id}), resolved before the request runs so in-flight
+    gauges can be kept per route. Resolutions are cached by method and path.
+    """
+
+    def __init__(self, app, metrics: Metrics, router, route_cache_size: int = 1024):
+        self.app = app
+        self.metrics = metrics
+        self.router = router
+        self.route_cache = LRUCache(route_cache_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self.route_cache.get((method, scope["path"]))
+        if route is None:
+            route = self._resolve(scope)
+            self.route_cache.set((method, scope["path"]), route)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.metrics.started(route, method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.finished(route, method, status_code, time.perf_counter() - start)
+
+    def _resolve(self, scope) -> str:
+        partial = None
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path  # path matches, method does not: a 405
+        return partial or UNMATCHED_ROUTE
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all other threads every interval seconds for a
+    time window and counts them in collapsed ("folded") form, root first,
+    as consumed by flamegraph.pl and speedscope. One window runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.running = False
+
+    def profile(self, seconds: float, interval: float) -> Counter:
+        """Sample for seconds and return a Counter of folded stacks. Blocks."""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("A profile is already running")
+            self.running = True
+        try:
+            return self._sample(seconds, interval)
+        finally:
+            self.running = False
+
+    def _sample(self, seconds: float, interval: float) -> Counter:
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return stacks
+
+
+def render_folded(stacks: Counter) -> str:
+    """Folded stacks, one "frame;frame;frame count" line each, most frequent first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,351 @@
+"""
+Snapshots and journals that let the memory backend survive restarts.
+
+A directory holds snapshot-<generation>.bin files and, per repository,
+journal segments <repository>-<generation>.log. Segment g records the
+mutations made after snapshot g was taken (segment 0: after an empty
+start), so the state is always the newest snapshot plus the segments from
+its generation on.
+
+Snapshots are a sequence of named sections: typed arrays and byte buffers
+are written raw and read back from a memory map, everything else is
+marshalled. Journal records are marshalled tuples framed with their length
+and a CRC, so a record torn by a crash is detected and dropped on replay.
+"""
+import gc
+import logging
+import marshal
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from array import array
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Storage attributes made durable, in the order they are snapshotted
+REPOSITORIES = ("users", "tokens", "revoked_tokens", "payments")
+
+SNAPSHOT_MAGIC = b"APISNAP1"
+_SECTION_HEADER = struct.Struct("<H")    # name length
+_SECTION_PAYLOAD = struct.Struct("<ccQ")  # kind, array typecode, payload length
+_FRAME_HEADER = struct.Struct("<II")     # record length, CRC-32
+_SNAPSHOT_FILE = re.compile(r"^snapshot-(\d+)\.bin$")
+_SEGMENT_FILE = re.compile(r"^(\w+)-(\d+)\.log$")
+
+
+def write_snapshot(path: str, sections: Dict[str, object]):
+    """Write sections to path atomically: to a temporary file, fsynced, then renamed."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        for name, value in sections.items():
+            if isinstance(value, array):
+                kind, typecode = b"a", value.typecode.encode()
+            elif isinstance(value, (bytes, bytearray)):
+                kind, typecode = b"b", b" "
+            else:
+                kind, typecode, value = b"m", b" ", marshal.dumps(value)
+            encoded_name = name.encode()
+            payload_size = len(value) * (value.itemsize if kind == b"a" else 1)
+            f.write(_SECTION_HEADER.pack(len(encoded_name)) + encoded_name)
+            f.write(_SECTION_PAYLOAD.pack(kind, typecode, payload_size))
+            f.write(value)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(os.path.dirname(path))
+
+
+def read_snapshot(path: str) -> Dict[str, object]:
+    """Read the sections written by write_snapshot() from a memory map."""
+    sections = {}
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            if view[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a snapshot")
+            offset = len(SNAPSHOT_MAGIC)
+            while offset < len(view):
+                (name_size,) = _SECTION_HEADER.unpack_from(view, offset)
+                offset += _SECTION_HEADER.size
+                name = bytes(view[offset:offset + name_size]).decode()
+                offset += name_size
+                kind, typecode, payload_size = _SECTION_PAYLOAD.unpack_from(view, offset)
+                offset += _SECTION_PAYLOAD.size
+                payload = view[offset:offset + payload_size]
+                if kind == b"a":
+                    value = array(typecode.decode())
+                    value.frombytes(payload)
+                elif kind == b"b":
+                    value = bytearray(payload)
+                else:
+                    value = marshal.loads(payload)
+                payload.release()
+                sections[name] = value
+                offset += payload_size
+    return sections
+
+
+def read_segment(path: str):
+    """Return a journal segment's records and the length of its intact prefix."""
+    with open(path, "rb") as f:
+        data = f.read()
+    records = []
+    offset = 0
+    while offset + _FRAME_HEADER.size <= len(data):
+        size, crc = _FRAME_HEADER.unpack_from(data, offset)
+        start = offset + _FRAME_HEADER.size
+        frame = data[start:start + size]
+        if len(frame) < size or zlib.crc32(frame) != crc:
+            break
+        records.append(marshal.loads(frame))
+        offset = start + size
+    return records, offset
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """
+    Append-only log of one repository's mutations. Appends are buffered;
+    sync() makes them durable and rotate() moves on to a new segment.
+    """
+
+    def __init__(self, directory: str, name: str, generation: int):
+        self.directory = directory
+        self.name = name
+        self._lock = threading.Lock()
+        self._file = None
+        self.appended = 0
+        self._open(generation)
+
+    def path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{self.name}-{generation:08d}.log")
+
+    def _open(self, generation: int):
+        self._file = open(self.path(generation), "ab")
+
+    def append(self, record: tuple):
+        self.append_many([record])
+
+    def append_many(self, records: List[tuple]):
+        frames = []
+        for record in records:
+            data = marshal.dumps(record)
+            frames.append(_FRAME_HEADER.pack(len(data), zlib.crc32(data)))
+            frames.append(data)
+        with self._lock:
+            if self._file.closed:
+                # A write racing shutdown; close() has already made the rest durable
+                logger.warning("Dropping %d records journaled after %s was closed",
+                               len(records), self.name)
+                return
+            self._file.write(b"".join(frames))
+            self.appended += len(records)
+
+    def sync(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def rotate(self, generation: int):
+        """Close the current segment durably and append to generation's from now on."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._open(generation)
+            self.appended = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Pause cyclic garbage collection while a snapshot's worth of objects is
+    built; each collection in between would only traverse them again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Persistence:
+    """
+    Durable state for a memory Storage.
+
+    load() restores the newest snapshot and replays the journal segments
+    after it; open() also attaches a Journal to every repository. start()
+    runs a background thread that fsyncs the journals every fsync_interval
+    seconds and, when anything changed, takes a snapshot every
+    snapshot_interval seconds. Snapshots copy each repository's state under
+    its write lock and serialize it afterwards, so requests keep being
+    served while a snapshot is written. Up to fsync_interval seconds of
+    mutations can be lost in a crash.
+    """
+
+    def __init__(self, storage, directory: str, snapshot_interval: float = 300.0,
+                 fsync_interval: float = 1.0):
+        self.storage = storage
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.fsync_interval = fsync_interval
+        self.generation = 0
+        self.journals: Dict[str, Journal] = {}
+        self.last_snapshot: Optional[dict] = None
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _repositories(self):
+        return [(name, getattr(self.storage, name)) for name in REPOSITORIES]
+
+    def _files(self):
+        """(snapshot generations, {(repository, generation): path}) found in the directory."""
+        snapshots, segments = [], {}
+        for entry in os.listdir(self.directory):
+            match = _SNAPSHOT_FILE.match(entry)
+            if match:
+                snapshots.append(int(match.group(1)))
+            match = _SEGMENT_FILE.match(entry)
+            if match and match.group(1) in REPOSITORIES:
+                segments[(match.group(1), int(match.group(2)))] = os.path.join(self.directory, entry)
+        return sorted(snapshots), segments
+
+    @_gc_paused()
+    def load(self) -> dict:
+        """Restore the newest snapshot and replay the journal after it. Returns timings."""
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots, segments = self._files()
+        self.generation = snapshots[-1] if snapshots else 0
+
+        if snapshots:
+            sections = read_snapshot(self._snapshot_path(self.generation))
+            for name, repository in self._repositories():
+                prefix = name + "."
+                repository.restore({key[len(prefix):]: value for key, value in sections.items()
+                                    if key.startswith(prefix)})
+            sections = None
+        snapshot_seconds = time.perf_counter() - started
+
+        replayed = 0
+        for (name, generation), path in sorted(segments.items(), key=lambda item: item[0][1]):
+            if generation < self.generation:
+                continue
+            records, intact = read_segment(path)
+            if intact < os.path.getsize(path):
+                logger.warning("Dropping a torn record at the end of %s", path)
+                with open(path, "r+b") as f:
+                    f.truncate(intact)
+            repository = getattr(self.storage, name)
+            for record in records:
+                repository.replay(record)
+            replayed += len(records)
+            # A crash mid-snapshot leaves segments newer than the snapshot
+            self.generation = max(self.generation, generation)
+
+        self._remove_older_than(snapshots[-1] if snapshots else 0)
+        return {
+            "generation": self.generation,
+            "snapshot_seconds": round(snapshot_seconds, 3),
+            "replayed_records": replayed,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+
+    def open(self) -> dict:
+        """load(), then journal every further mutation."""
+        stats = self.load()
+        for name, repository in self._repositories():
+            journal = self.journals[name] = Journal(self.directory, name, self.generation)
+            repository.journal = journal
+        return stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="persistence", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_snapshot = time.monotonic()
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                for journal in self.journals.values():
+                    journal.sync()
+                if (time.monotonic() - last_snapshot >= self.snapshot_interval
+                        and any(journal.appended for journal in self.journals.values())):
+                    self.snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception:
+                logger.exception("Persisting the memory backend failed")
+
+    def _snapshot_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{generation:08d}.bin")
+
+    def snapshot(self) -> dict:
+        """Write a snapshot of every repository and drop the journal it supersedes."""
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            generation = self.generation + 1
+            sections = {}
+            with _gc_paused():
+                for name, repository in self._repositories():
+                    journal = self.journals.get(name)
+                    rotate = (lambda: journal.rotate(generation)) if journal else (lambda: None)
+                    for key, value in repository.snapshot(rotate).items():
+                        sections[f"{name}.{key}"] = value
+            self.generation = generation
+            path = self._snapshot_path(generation)
+            write_snapshot(path, sections)
+            self._remove_older_than(generation)
+            self.last_snapshot = {
+                "generation": generation,
+                "bytes": os.path.getsize(path),
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+            return self.last_snapshot
+
+    def _remove_older_than(self, generation: int):
+        snapshots, segments = self._files()
+        stale = [self._snapshot_path(g) for g in snapshots if g < generation]
+        stale += [path for (_, g), path in segments.items() if g < generation]
+        for path in stale:
+            os.remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "generation": self.generation,
+            "journaled_since_snapshot": {name: journal.appended
+                                         for name, journal in self.journals.items()},
+            "last_snapshot": self.last_snapshot
+        }
+
+    def close(self):
+        """Stop the background thread and make the journals durable."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for name, repository in self._repositories():
+            repository.journal = None
+        for journal in self.journals.values():
+            journal.close()
@@ -0,0 +1,181 @@
+"""
+Asynchronous payment processing: payments are accepted as pending, queued,
+and submitted to a payment processor in micro-batches by background tasks.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentProcessor:
+    """An external payment processor, called with a micro-batch at a time."""
+
+    async def process(self, payments: List[dict]) -> Dict[str, str]:
+        """Submit payments; return the final status ("completed" or "failed") by payment_id."""
+        raise NotImplementedError
+
+
+class SimulatedProcessor(PaymentProcessor):
+    """
+    Local stand-in for a processor. Each call takes latency seconds plus up
+    to jitter more, then fails each payment with probability failure_rate.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.05, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    async def process(self, payments):
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        return {
+            payment["payment_id"]: "failed" if self._random.random() < self.failure_rate
+            else "completed"
+            for payment in payments
+        }
+
+
+class PaymentPipeline:
+    """
+    A bounded intake queue drained by worker tasks.
+
+    submit() never waits: callers check free() first and shed load when the
+    queue is full, and reserve() the room meanwhile if they await before
+    submitting. Each worker takes up to batch_size payments, waiting at
+    most batch_wait seconds for a batch to fill, submits them in one
+    processor call and saves the outcomes with update_statuses, which runs
+    on the default executor. A batch whose processor call raises is marked
+    failed. start() and stop() run on the event loop that serves requests.
+    Payments never sent to the processor before stop() gives up are marked
+    failed; the ids of those caught mid-call are logged, as their outcome
+    is unknown.
+    """
+
+    def __init__(self, processor: PaymentProcessor,
+                 update_statuses: Callable[[Iterable[Tuple[str, str]]], int],
+                 queue_size: int, workers: int, batch_size: int, batch_wait: float):
+        self.processor = processor
+        self.update_statuses = update_statuses
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: Set[str] = set()
+        self.reserved = 0
+        self.processing = 0
+        self.batches = 0
+        self.submitted = 0
+        self.processor_errors = 0
+        self.outcomes: Dict[str, int] = {}
+        self.processor_seconds = 0.0
+
+    def start(self):
+        # Created here rather than in __init__ so the queue binds to the running loop
+        self.queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float):
+        """Give the workers up to timeout seconds to finish the queue, then cancel them."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        unsent = []
+        while not self.queue.empty():
+            unsent.append(self.queue.get_nowait()["payment_id"])
+            self.queue.task_done()
+        if unsent:
+            logger.warning("Stopping before %d queued payments reached the processor; "
+                           "marking them failed: %s", len(unsent), ", ".join(unsent))
+            updates = [(payment_id, "failed") for payment_id in unsent]
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.update_statuses, updates)
+            self.outcomes["failed"] = self.outcomes.get("failed", 0) + len(unsent)
+        if self._in_flight:
+            logger.warning("Stopping with %d payments left pending mid-call, outcome unknown: %s",
+                           len(self._in_flight), ", ".join(sorted(self._in_flight)))
+
+    def free(self) -> int:
+        """Payments that can be submitted now; 0 before start()."""
+        if self.queue is None:
+            return 0
+        return self.queue.maxsize - self.queue.qsize() - self.reserved
+
+    def reserve(self, count: int):
+        """Hold room for count payments, which free() has reported, until release()."""
+        self.reserved += count
+
+    def release(self, count: int):
+        self.reserved -= count
+
+    def submit(self, payments: List[dict]):
+        """Queue stored pending payments; there must be room for all of them."""
+        for payment in payments:
+            self.queue.put_nowait(payment)
+
+    async def _work(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.queue.qsize() < self.batch_size - 1 and self.batch_wait > 0:
+                await asyncio.sleep(self.batch_wait)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.processing += len(batch)
+            payment_ids = [payment["payment_id"] for payment in batch]
+            self._in_flight.update(payment_ids)
+            try:
+                await self._process(batch)
+            except Exception:
+                # Left pending; the worker carries on with the next batch
+                logger.exception("Saving the outcome of %d payments failed", len(batch))
+            finally:
+                self.processing -= len(batch)
+                for _ in batch:
+                    self.queue.task_done()
+            # Skipped when stop() cancels the worker mid-call
+            self._in_flight.difference_update(payment_ids)
+
+    async def _process(self, batch: List[dict]):
+        started = time.perf_counter()
+        try:
+            results = await self.processor.process(batch)
+        except Exception:
+            logger.exception("The payment processor failed a batch of %d", len(batch))
+            self.processor_errors += 1
+            results = {}
+        self.processor_seconds += time.perf_counter() - started
+        self.batches += 1
+        self.submitted += len(batch)
+
+        updates = [(payment["payment_id"], results.get(payment["payment_id"], "failed"))
+                   for payment in batch]
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.update_statuses, updates)
+        for _, outcome in updates:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.queue_size,
+            "processing": self.processing,
+            "batches": self.batches,
+            "mean_batch_size": round(self.submitted / self.batches, 2)
+            if self.batches else 0.0,
+            "mean_processor_seconds": round(self.processor_seconds / self.batches, 4)
+            if self.batches else 0.0,
+            "processor_errors": self.processor_errors,
+            "outcomes": dict(self.outcomes)
+        }
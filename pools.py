@@ -0,0 +1,99 @@
+"""
+Pools of pre-generated fake records for the /demo/generate-* endpoints.
+"""
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Callable
+
+
+class RecordPool:
+    """
+    Records generated ahead of time and handed out in O(1).
+
+    When the pool drops below low_water a background refill tops it back up
+    to size on the given executor, each worker thread using its own Faker
+    from make_faker. A take() from an empty pool counts as a miss and
+    generates the record inline with fallback_faker. warm() fills a new
+    pool to low_water before it is used. Counters are updated under the
+    pool's lock, as take() runs on many threads.
+    """
+
+    def __init__(self, generate: Callable, size: int, low_water: int, executor: Executor,
+                 make_faker: Callable, fallback_faker):
+        self._generate = generate
+        self.size = size
+        self.low_water = low_water
+        self._executor = executor
+        self._make_faker = make_faker
+        self._fallback_faker = fallback_faker
+        self._records = deque()
+        self._refilling = False
+        self._lock = threading.Lock()
+        self._worker_fakers = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+
+    def warm(self) -> Future:
+        """
+        Fill the pool to low_water on the executor, then go on refilling it
+        to size in the background. The future completes at low_water.
+        """
+        return self._executor.submit(self._warm)
+
+    def _warm(self):
+        faker = self._worker_faker()
+        while len(self._records) < self.low_water:
+            self._records.append(self._generate(faker))
+        self._schedule_refill()
+
+    def take(self) -> dict:
+        try:
+            record = self._records.popleft()
+        except IndexError:
+            record = None
+        with self._lock:
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if len(self._records) < self.low_water:
+            self._schedule_refill()
+        if record is None:
+            return self._generate(self._fallback_faker)
+        return record
+
+    def _schedule_refill(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        self._executor.submit(self._refill)
+
+    def _worker_faker(self):
+        faker = getattr(self._worker_fakers, "faker", None)
+        if faker is None:
+            faker = self._worker_fakers.faker = self._make_faker()
+        return faker
+
+    def _refill(self):
+        try:
+            faker = self._worker_faker()
+            while len(self._records) < self.size:
+                self._records.append(self._generate(faker))
+            with self._lock:
+                self.refills += 1
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": len(self._records),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refills": self.refills
+            }
@@ -0,0 +1,75 @@
+"""
+Token-bucket rate limiting for admission control.
+"""
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key. A bucket holds up to burst tokens, refills at
+    rate tokens per second, and each admitted request spends one token.
+
+    Buckets are kept in least-recently-updated order. A bucket left alone
+    for burst / rate seconds is full again, which is the same as having no
+    bucket, so such buckets are dropped from the cold end as requests
+    arrive. Past max_keys the coldest bucket is dropped regardless. That
+    makes acquire() O(1) amortized and memory bounded.
+
+    Used from the event loop only, so no locking is needed.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._refill_seconds = burst / rate
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self.rejections = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Spend a token from key's bucket. Returns 0, or the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        self._drop_refilled(now)
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+            self.rejections += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+        return wait
+
+    def _drop_refilled(self, now: float):
+        # The coldest bucket was updated longest ago; once it is not yet
+        # refilled, no other bucket is
+        while self._buckets:
+            _, updated_at = next(iter(self._buckets.values()))
+            if now - updated_at < self._refill_seconds:
+                return
+            self._buckets.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._buckets),
+            "max_keys": self.max_keys,
+            "rate": self.rate,
+            "burst": self.burst,
+            "rejections": self.rejections,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,182 @@
+"""
+Bulk seeding of users and payments for load tests.
+
+Generation is split into shards that run on a process pool. Each shard is
+seeded from (seed, shard number), so the same arguments always produce the
+same users and payments. Payment timestamps and card expiry years count
+back from a fixed base time, DEFAULT_BASE_TIME unless --base-time is
+given, rather than from today. Shards are merged into the stores in shard order,
+in batches, as they complete.
+
+Seeded users are named seed_user_<n> and all share one password, which is
+hashed once up front rather than per user.
+
+    STORAGE_BACKEND=sqlite python seed.py --users 1000000 --payments-per-user 5
+
+With the memory backend and PERSIST_DIR set, the seeded state is loaded on
+top of the directory's current state and written out as a new snapshot for
+the server to start from. Stop the server first, since it journals into the
+same directory.
+
+    PERSIST_DIR=data PAYMENT_STORE=columnar python seed.py --users 1000000 --payments-per-user 5
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+DEFAULT_PASSWORD = "SeedPassw0rd"
+DEFAULT_BASE_TIME = datetime(2024, 1, 1)
+STATUSES = ("completed", "pending", "failed")
+
+
+def generate_shard(seed: int, shard: int, first_user: int, users: int, payments_per_user: int,
+                   hashed_password: str, base_time: datetime):
+    """Generate one shard's users and payments; runs in a worker process."""
+    from faker import Faker
+
+    rng = random.Random(f"{seed}:{shard}")
+    faker = Faker()
+    faker.seed_instance(f"{seed}:{shard}")
+
+    def new_id() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    shard_users = []
+    shard_payments = []
+    for index in range(first_user, first_user + users):
+        username = f"seed_user_{index}"
+        user_id = new_id()
+        shard_users.append({
+            "email": f"{username}@{faker.free_email_domain()}",
+            "username": username,
+            "hashed_password": hashed_password,
+            "user_id": user_id
+        })
+        for _ in range(payments_per_user):
+            card_number = faker.credit_card_number()
+            shard_payments.append({
+                "payment_id": new_id(),
+                "user_id": user_id,
+                "full_card_number": card_number,
+                "card_last_four": card_number[-4:],
+                "card_holder": faker.name(),
+                "expiry_month": rng.randint(1, 12),
+                "expiry_year": rng.randint(base_time.year, base_time.year + 5),
+                "cvv": f"{rng.randint(0, 999):03d}",
+                "amount": rng.randint(100, 99999) / 100,
+                "status": rng.choice(STATUSES),
+                "timestamp": base_time - timedelta(seconds=rng.randint(0, 30 * 24 * 3600)),
+                "description": faker.text(max_nb_chars=100)
+            })
+    return shard_users, shard_payments
+
+
+def seed_storage(storage, users: int, payments_per_user: int, hashed_password: str,
+                 seed: int = 0, workers: Optional[int] = None, shard_size: int = 10_000,
+                 batch_size: int = 10_000, base_time: datetime = DEFAULT_BASE_TIME,
+                 progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Generate users and payments on a process pool and insert them into
+    storage. workers defaults to, and is capped at, the CPU count. progress,
+    if given, receives the running totals after each shard is merged.
+    Returns the final totals.
+    """
+    cpus = os.cpu_count() or 1
+    workers = min(workers or cpus, cpus)
+    shards = [(shard, first, min(shard_size, users - first))
+              for shard, first in enumerate(range(0, users, shard_size))]
+    totals = {"users": 0, "payments": 0, "skipped_users": 0,
+              "shards_done": 0, "shards_total": len(shards), "elapsed_seconds": 0.0}
+    started = time.perf_counter()
+
+    # spawn rather than fork: the server calling this has threads running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        queued = iter(shards)
+        for shard, first, count in queued:
+            pending.append(executor.submit(generate_shard, seed, shard, first, count,
+                                           payments_per_user, hashed_password, base_time))
+            if len(pending) < 2 * workers:
+                continue
+            _merge(storage, pending.popleft().result(), batch_size, totals)
+            totals["elapsed_seconds"] = time.perf_counter() - started
+            if progress:
+                progress(dict(totals))
+        while pending:
+            _merge(storage, pending.popleft().result(), batch_size, totals)
+            totals["elapsed_seconds"] = time.perf_counter() - started
+            if progress:
+                progress(dict(totals))
+    return totals
+
+
+def _merge(storage, shard_result, batch_size: int, totals: dict):
+    shard_users, shard_payments = shard_result
+    skipped = set()
+    for start in range(0, len(shard_users), batch_size):
+        batch = shard_users[start:start + batch_size]
+        for user, added in zip(batch, storage.users.add_many(batch)):
+            if not added:
+                skipped.add(user["user_id"])
+    if skipped:
+        # Usernames already present, e.g. from an earlier run of the same seed
+        shard_payments = [p for p in shard_payments if p["user_id"] not in skipped]
+    for start in range(0, len(shard_payments), batch_size):
+        storage.payments.add_many(shard_payments[start:start + batch_size])
+    totals["users"] += len(shard_users) - len(skipped)
+    totals["skipped_users"] += len(skipped)
+    totals["payments"] += len(shard_payments)
+    totals["shards_done"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, required=True)
+    parser.add_argument("--payments-per-user", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=10_000)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--base-time", type=datetime.fromisoformat, default=DEFAULT_BASE_TIME,
+                        help="ISO date or datetime that payment timestamps count back from")
+    args = parser.parse_args()
+
+    # Reuse the server's storage settings and password hashing
+    import main as api
+
+    if api.STORAGE_BACKEND == "memory" and api.persistence is None:
+        sys.exit("The memory backend does not outlive this process; set PERSIST_DIR or "
+                 "STORAGE_BACKEND=sqlite, or seed a running server through POST /demo/seed")
+    if api.persistence is not None:
+        print(f"loaded: {api.persistence.load()}", flush=True)
+
+    def report(totals):
+        print(f"shard {totals['shards_done']}/{totals['shards_total']}: "
+              f"{totals['users']:,} users, {totals['payments']:,} payments "
+              f"in {totals['elapsed_seconds']:.1f}s", flush=True)
+
+    try:
+        totals = seed_storage(api.storage, args.users, args.payments_per_user,
+                              api.hash_password(args.password), seed=args.seed,
+                              workers=args.workers, shard_size=args.shard_size,
+                              base_time=args.base_time, progress=report)
+        if api.persistence is not None:
+            print(f"snapshot: {api.persistence.snapshot()}", flush=True)
+    finally:
+        api.storage.close()
+    print(f"done: {totals['users']:,} users ({totals['skipped_users']:,} already present), "
+          f"{totals['payments']:,} payments in {totals['elapsed_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1475 @@
+"""
+Storage backends for users, tokens and payments.
+
+create_storage() returns a Storage bundling one repository of each kind.
+The "memory" backend keeps everything in process-local dicts. The "sqlite"
+backend keeps it in a WAL-mode database file that survives restarts and can
+be shared by several worker processes.
+"""
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from heapq import heapify, heappop, heappush
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+_EPOCH = datetime(1970, 1, 1)
+_DAY_MICROS = 24 * 3600 * 10 ** 6
+
+
+def to_micros(timestamp: datetime) -> int:
+    """Convert a naive timestamp to integer microseconds since the epoch."""
+    return (timestamp - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+# Payment fields in the order used by SQLite rows and journal records
+PAYMENT_COLUMNS = (
+    "payment_id", "user_id", "full_card_number", "card_last_four", "card_holder",
+    "expiry_month", "expiry_year", "cvv", "amount", "status", "timestamp", "description"
+)
+
+
+def _payment_to_row(payment: dict) -> tuple:
+    row = [payment[column] for column in PAYMENT_COLUMNS]
+    row[PAYMENT_COLUMNS.index("timestamp")] = to_micros(payment["timestamp"])
+    return tuple(row)
+
+
+def _payment_from_row(row) -> dict:
+    payment = dict(zip(PAYMENT_COLUMNS, row))
+    payment["timestamp"] = from_micros(payment["timestamp"])
+    return payment
+
+
+# --- Repository interfaces ---
+
+class UserRepository:
+    """Users keyed by username."""
+
+    def get(self, username: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def add(self, user: dict) -> bool:
+        """Insert a user; returns False if the username is already taken."""
+        raise NotImplementedError
+
+    def add_many(self, users: Iterable[dict]) -> List[bool]:
+        """Insert users in one batch; returns add()'s result for each."""
+        raise NotImplementedError
+
+    def update_password(self, username: str, hashed_password: str):
+        raise NotImplementedError
+
+    def first(self) -> Optional[dict]:
+        """Return any one user, or None when there are none."""
+        raise NotImplementedError
+
+    def __contains__(self, username: str) -> bool:
+        return self.get(username) is not None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class TokenRepository:
+    """Expiring tokens, each belonging to a username."""
+
+    def issue(self, token: str, username: str, ttl_seconds: Optional[int] = None):
+        raise NotImplementedError
+
+    def get(self, token: str) -> Optional[str]:
+        """Return the username for a live token, or None."""
+        raise NotImplementedError
+
+    def revoke(self, token: str) -> bool:
+        raise NotImplementedError
+
+    def sweep(self, max_items: int) -> int:
+        """Drop up to max_items expired tokens; returns how many went."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class PaymentRepository:
+    """
+    Payments keyed by payment_id. Each user's payments, and all payments
+    together, are ordered by the key (timestamp, payment_id). Time ranges
+    are half-open: since <= timestamp < until, either end optional.
+    """
+
+    def add(self, payment: dict):
+        raise NotImplementedError
+
+    def add_many(self, payments: Iterable[dict]):
+        raise NotImplementedError
+
+    def get(self, payment_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def update_statuses(self, updates: Iterable[Tuple[str, str]]) -> int:
+        """
+        Apply (payment_id, status) updates, keeping summaries in step.
+        Unknown ids and unchanged statuses are skipped; returns the number
+        of payments changed.
+        """
+        raise NotImplementedError
+
+    def list_for_user(self, user_id: str, limit: int,
+                      after: Optional[Tuple[datetime, str]] = None,
+                      since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> List[dict]:
+        """Return up to limit of a user's payments in the time range, ordered after the given key."""
+        raise NotImplementedError
+
+    def list_range(self, limit: int, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None,
+                   after: Optional[Tuple[datetime, str]] = None) -> List[dict]:
+        """Return up to limit of all users' payments in the time range, ordered after the given key."""
+        raise NotImplementedError
+
+    def iter_all(self) -> Iterator[dict]:
+        raise NotImplementedError
+
+    def summary(self, user_id: str) -> dict:
+        """
+        Return a user's payment count and total overall, per status and per
+        calendar day, as kept up to date by every insert.
+        """
+        raise NotImplementedError
+
+    def version(self, user_id: str) -> int:
+        """
+        A counter bumped by every insert or status change of a user's
+        payments, so equal versions mean unchanged listings.
+        """
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+def empty_summary() -> dict:
+    return {"count": 0, "total": 0.0, "by_status": {}, "by_day": {}}
+
+
+class Storage:
+    """One repository of each kind, as returned by create_storage()."""
+
+    def __init__(self, users: UserRepository, tokens: TokenRepository,
+                 revoked_tokens: TokenRepository, payments: PaymentRepository,
+                 close=None):
+        self.users = users
+        self.tokens = tokens
+        self.revoked_tokens = revoked_tokens
+        self.payments = payments
+        self._close = close
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+
+# --- In-memory backend ---
+#
+# Memory repositories can be made durable by persistence.Persistence. Each
+# passes its mutations to self.journal, when one is attached, while holding
+# the lock that serializes its writes. snapshot() switches the journal to a
+# new segment and copies the state under that same lock, so every mutation
+# ends up either in the snapshot or in the new segment, never both. replay()
+# applies a journal record and restore() loads snapshot() sections, both
+# without journaling.
+
+USER_FIELDS = ("username", "user_id", "email", "hashed_password")
+
+
+class MemoryUserRepository(UserRepository):
+
+    def __init__(self):
+        self._users = {}
+        self.journal = None
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        return self._users.get(username)
+
+    def add(self, user):
+        with self._lock:
+            added = self._users.setdefault(user["username"], user) is user
+            journal = self.journal
+            if added and journal is not None:
+                journal.append(("add", *(user[field] for field in USER_FIELDS)))
+        return added
+
+    def add_many(self, users):
+        return [self.add(user) for user in users]
+
+    def update_password(self, username, hashed_password):
+        with self._lock:
+            self._users[username]["hashed_password"] = hashed_password
+            journal = self.journal
+            if journal is not None:
+                journal.append(("password", username, hashed_password))
+
+    def first(self):
+        return next(iter(self._users.values()), None)
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def snapshot(self, rotate: Callable[[], None]) -> dict:
+        with self._lock:
+            rotate()
+            users = list(self._users.values())
+        return {"users": [tuple(user[field] for field in USER_FIELDS) for user in users]}
+
+    def restore(self, sections: dict):
+        for fields in sections["users"]:
+            self._users[fields[0]] = dict(zip(USER_FIELDS, fields))
+
+    def replay(self, record: tuple):
+        if record[0] == "add":
+            self._users.setdefault(record[1], dict(zip(USER_FIELDS, record[1:])))
+        elif record[0] == "password":
+            self._users[record[1]]["hashed_password"] = record[2]
+
+
+class MemoryTokenRepository(TokenRepository):
+    """
+    Access tokens with a TTL, a per-user cap and a global size cap.
+
+    Lookups are a single dict access. Expired tokens are dropped lazily on
+    lookup and by sweep(), which pops an expiry heap so each tick only looks
+    at tokens that are actually due.
+    """
+
+    def __init__(self, ttl_seconds: int, max_per_user: Optional[int] = None,
+                 max_size: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_per_user = max_per_user
+        self.max_size = max_size
+        self._tokens = {}       # token -> (username, expires_at)
+        self._by_user = {}      # username -> {token: None}, oldest first
+        self._expiry_heap = []  # (expires_at, token); may hold stale entries
+        self.expired_evictions = 0
+        self.cap_evictions = 0
+        self.revocations = 0
+        # Only issue() and revoke() are journaled: expiry and cap evictions
+        # happen again by themselves when the journal is replayed
+        self.journal = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def issue(self, token, username, ttl_seconds=None):
+        """Store a token for a user, evicting older tokens past the caps."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._issue(token, username, expires_at)
+            journal = self.journal
+            if journal is not None:
+                journal.append(("issue", token, username, expires_at))
+
+    def _issue(self, token, username, expires_at):
+        if self.max_per_user is not None:
+            user_tokens = self._by_user.get(username, {})
+            while len(user_tokens) >= self.max_per_user:
+                self._remove(next(iter(user_tokens)))
+                self.cap_evictions += 1
+        if self.max_size is not None:
+            while len(self._tokens) >= self.max_size:
+                expiry, oldest = heappop(self._expiry_heap)
+                entry = self._tokens.get(oldest)
+                if entry is not None and entry[1] == expiry:
+                    self._remove(oldest)
+                    self.cap_evictions += 1
+
+        self._tokens[token] = (username, expires_at)
+        self._by_user.setdefault(username, {})[token] = None
+        heappush(self._expiry_heap, (expires_at, token))
+
+        # Revoked and evicted tokens leave stale heap entries behind
+        if len(self._expiry_heap) > 2 * len(self._tokens) + 1024:
+            self._expiry_heap = [(entry[1], t) for t, entry in self._tokens.items()]
+            heapify(self._expiry_heap)
+
+    def get(self, token):
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        username, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(token)
+            self.expired_evictions += 1
+            return None
+        return username
+
+    def revoke(self, token):
+        with self._lock:
+            if token not in self._tokens:
+                return False
+            self._remove(token)
+            self.revocations += 1
+            journal = self.journal
+            if journal is not None:
+                journal.append(("revoke", token))
+        return True
+
+    def sweep(self, max_items):
+        """Drop expired tokens, examining at most max_items heap entries."""
+        now = time.time()
+        heap = self._expiry_heap
+        removed = 0
+        for _ in range(max_items):
+            if not heap or heap[0][0] > now:
+                break
+            expires_at, token = heappop(heap)
+            entry = self._tokens.get(token)
+            if entry is not None and entry[1] == expires_at:
+                self._remove(token)
+                removed += 1
+        self.expired_evictions += removed
+        return removed
+
+    def stats(self):
+        return {
+            "size": len(self._tokens),
+            "users": len(self._by_user),
+            "expired_evictions": self.expired_evictions,
+            "cap_evictions": self.cap_evictions,
+            "revocations": self.revocations
+        }
+
+    def _remove(self, token):
+        username, _ = self._tokens.pop(token)
+        user_tokens = self._by_user[username]
+        del user_tokens[token]
+        if not user_tokens:
+            del self._by_user[username]
+
+    def snapshot(self, rotate: Callable[[], None]) -> dict:
+        with self._lock:
+            rotate()
+            tokens = list(self._tokens.items())
+        # In issue order, so per-user caps evict the same tokens on restore
+        return {"tokens": [(token, username, expires_at)
+                           for token, (username, expires_at) in tokens]}
+
+    def restore(self, sections: dict):
+        now = time.time()
+        for token, username, expires_at in sections["tokens"]:
+            if expires_at > now:
+                self._issue(token, username, expires_at)
+
+    def replay(self, record: tuple):
+        if record[0] == "issue":
+            _, token, username, expires_at = record
+            if token not in self._tokens and expires_at > time.time():
+                self._issue(token, username, expires_at)
+        elif record[0] == "revoke" and record[1] in self._tokens:
+            self._remove(record[1])
+
+
+class _PaymentSummary:
+    """Running count and total in cents of one user's payments."""
+
+    __slots__ = ("count", "cents", "by_status", "by_day")
+
+    def __init__(self):
+        self.count = 0
+        self.cents = 0
+        self.by_status = {}  # status -> [count, cents]
+        self.by_day = {}     # ISO date -> [count, cents]
+
+    def add(self, status: str, day: str, cents: int):
+        self.count += 1
+        self.cents += cents
+        for totals in (self.by_status.setdefault(status, [0, 0]),
+                       self.by_day.setdefault(day, [0, 0])):
+            totals[0] += 1
+            totals[1] += cents
+
+    def move(self, old_status: str, new_status: str, cents: int):
+        """Count a payment under new_status instead of old_status."""
+        totals = self.by_status[old_status]
+        totals[0] -= 1
+        totals[1] -= cents
+        if not totals[0]:
+            del self.by_status[old_status]
+        totals = self.by_status.setdefault(new_status, [0, 0])
+        totals[0] += 1
+        totals[1] += cents
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.cents / 100,
+            "by_status": {status: {"count": count, "total": cents / 100}
+                          for status, (count, cents) in self.by_status.items()},
+            "by_day": {day: {"count": count, "total": cents / 100}
+                       for day, (count, cents) in sorted(self.by_day.items())}
+        }
+
+
+class _SortedIndex:
+    """
+    Items ordered by key(item), split into blocks of at most 2 * load items
+    with each block's largest key alongside. An insert bisects the block
+    keys and then one block, so it moves O(load) items rather than O(n),
+    and a range costs O(log n + k). Blocks are arrays of typecode when one
+    is given, otherwise lists.
+    """
+
+    def __init__(self, key: Optional[Callable] = None, typecode: Optional[str] = None,
+                 load: int = 1000):
+        self._key = key
+        self._typecode = typecode
+        self._load = load
+        self._blocks = []
+        self._maxes = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def _item_key(self, item):
+        return item if self._key is None else self._key(item)
+
+    def _position(self, block, key, right: bool) -> int:
+        """bisect_left (or bisect_right) of key in block, by item key."""
+        if self._key is None:
+            return bisect_right(block, key) if right else bisect_left(block, key)
+        lo, hi = 0, len(block)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            item_key = self._key(block[mid])
+            if item_key < key or (right and item_key == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def add(self, item):
+        key = self._item_key(item)
+        self._len += 1
+        if not self._blocks:
+            self._blocks.append(array(self._typecode, [item]) if self._typecode else [item])
+            self._maxes.append(key)
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            # The common case for payments stamped with the current time
+            i -= 1
+            self._blocks[i].append(item)
+            self._maxes[i] = key
+        else:
+            block = self._blocks[i]
+            block.insert(self._position(block, key, right=True), item)
+        block = self._blocks[i]
+        if len(block) > 2 * self._load:
+            self._blocks.insert(i + 1, block[self._load:])
+            del block[self._load:]
+            self._maxes.insert(i, self._item_key(block[-1]))
+
+    def export(self):
+        """All items in order in one array, and the length of each block."""
+        items = array(self._typecode)
+        for block in self._blocks:
+            items.extend(block)
+        return items, array("Q", map(len, self._blocks))
+
+    def load(self, items, lengths=None):
+        """
+        Replace the contents with sorted items, split into blocks as given by
+        export() or, without lengths, into blocks of load items.
+        """
+        if lengths is None:
+            lengths = [min(self._load, len(items) - start)
+                       for start in range(0, len(items), self._load)]
+        self._blocks, self._maxes, start = [], [], 0
+        for length in lengths:
+            self._blocks.append(items[start:start + length])
+            self._maxes.append(self._item_key(items[start + length - 1]))
+            start += length
+        self._len = len(items)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the blocks, when they are arrays."""
+        return sum(block.itemsize * len(block) for block in self._blocks)
+
+    def slice(self, limit: int, low=None, high=None, low_inclusive: bool = True) -> list:
+        """Up to limit items in key order from low (inclusive or not) to high (exclusive)."""
+        if low is None:
+            i, j = 0, 0
+        else:
+            i = (bisect_left if low_inclusive else bisect_right)(self._maxes, low)
+            if i == len(self._blocks):
+                return []
+            j = self._position(self._blocks[i], low, right=not low_inclusive)
+        items = []
+        while i < len(self._blocks) and len(items) < limit:
+            block = self._blocks[i]
+            end = min(len(block), j + limit - len(items))
+            if high is not None and self._maxes[i] >= high:
+                end = min(end, self._position(block, high, right=False))
+                items.extend(block[j:end])
+                break
+            items.extend(block[j:end])
+            i, j = i + 1, 0
+        return items
+
+
+def _range_start(since_key, after_key):
+    """
+    The start of a range as (low, inclusive): from since_key inclusive or
+    strictly after after_key, whichever is later.
+    """
+    if after_key is not None and (since_key is None or after_key >= since_key):
+        return after_key, False
+    return since_key, True
+
+
+class MemoryPaymentRepository(PaymentRepository):
+    """
+    Payments in a dict, plus a user_id -> [(timestamp, payment_id), ...]
+    index kept in order and a global (timestamp, payment_id) index, so a
+    page or time range costs O(log n + limit).
+    """
+
+    def __init__(self):
+        self._payments = {}
+        self._by_user = {}
+        self._by_time = _SortedIndex()
+        self._summaries = {}
+        self._versions = {}
+        # Demo handlers insert from worker threads while the loop lists
+        self._lock = threading.Lock()
+        self.journal = None
+
+    def add(self, payment):
+        self.add_many([payment])
+
+    def add_many(self, payments):
+        with self._lock:
+            journal = self.journal
+            records = []
+            for payment in payments:
+                self._insert(payment)
+                if journal is not None:
+                    records.append(("add", *_payment_to_row(payment)))
+            if records:
+                journal.append_many(records)
+
+    def _insert(self, payment):
+        self._payments[payment["payment_id"]] = payment
+        user_index = self._by_user.setdefault(payment["user_id"], [])
+        key = (payment["timestamp"], payment["payment_id"])
+        insort(user_index, key)
+        self._by_time.add(key)
+        self._summaries.setdefault(payment["user_id"], _PaymentSummary()).add(
+            payment["status"], payment["timestamp"].date().isoformat(),
+            round(payment["amount"] * 100))
+        self._versions[payment["user_id"]] = self._versions.get(payment["user_id"], 0) + 1
+
+    def get(self, payment_id):
+        return self._payments.get(payment_id)
+
+    def update_statuses(self, updates):
+        with self._lock:
+            changed = [update for update in updates if self._set_status(*update)]
+            if changed and self.journal is not None:
+                self.journal.append_many([("status", *update) for update in changed])
+            return len(changed)
+
+    def _set_status(self, payment_id: str, status: str) -> bool:
+        payment = self._payments.get(payment_id)
+        if payment is None or payment["status"] == status:
+            return False
+        # Replaced rather than changed in place, as readers may hold the old dict
+        self._payments[payment_id] = dict(payment, status=status)
+        self._summaries[payment["user_id"]].move(payment["status"], status,
+                                                 round(payment["amount"] * 100))
+        self._versions[payment["user_id"]] += 1
+        return True
+
+    def list_for_user(self, user_id, limit, after=None, since=None, until=None):
+        with self._lock:
+            user_index = self._by_user.get(user_id, [])
+            start = bisect_right(user_index, after) if after else 0
+            if since:
+                # (since,) sorts before every key at that timestamp
+                start = max(start, bisect_left(user_index, (since,)))
+            end = bisect_left(user_index, (until,)) if until else len(user_index)
+            return [self._payments[payment_id]
+                    for _, payment_id in user_index[start:min(start + limit, end)]]
+
+    def list_range(self, limit, since=None, until=None, after=None):
+        low, inclusive = _range_start((since,) if since else None, after)
+        with self._lock:
+            keys = self._by_time.slice(limit, low, (until,) if until else None, inclusive)
+            return [self._payments[payment_id] for _, payment_id in keys]
+
+    def iter_all(self):
+        with self._lock:
+            payments = list(self._payments.values())
+        return iter(payments)
+
+    def summary(self, user_id):
+        with self._lock:
+            summary = self._summaries.get(user_id)
+            return summary.as_dict() if summary else empty_summary()
+
+    def version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def __len__(self):
+        return len(self._payments)
+
+    def snapshot(self, rotate):
+        with self._lock:
+            rotate()
+            payments = list(self._payments.values())
+        # Snapshots share the columnar layout, whichever store wrote them
+        payments.sort(key=lambda payment: (payment["timestamp"], payment["payment_id"]))
+        columns = ColumnarPaymentRepository()
+        columns.add_many(payments)
+        sections = columns.snapshot(lambda: None)
+        # The columns hold whole cents; keep the amounts as stored, in row
+        # order, which is also iter_by_time() order as rows went in sorted
+        sections["exact_amounts"] = array("d", (payment["amount"] for payment in payments))
+        return sections
+
+    def restore(self, sections):
+        """Load a snapshot into an empty repository, building the indexes in bulk."""
+        columns = ColumnarPaymentRepository()
+        columns.restore(sections)
+        exact_amounts = sections.get("exact_amounts")
+        keys = []
+        # In (timestamp, payment_id) order, so every index is built by appending
+        for row, payment in enumerate(columns.iter_by_time()):
+            if exact_amounts is not None:
+                payment["amount"] = exact_amounts[row]
+            key = (payment["timestamp"], payment["payment_id"])
+            self._payments[payment["payment_id"]] = payment
+            self._by_user.setdefault(payment["user_id"], []).append(key)
+            keys.append(key)
+        self._by_time.load(keys)
+        user_ids = sections["user_ids"]
+        for code, count, cents, by_status, by_day in sections["summaries"]:
+            summary = self._summaries[user_ids[code]] = _PaymentSummary()
+            summary.count, summary.cents = count, cents
+            summary.by_status, summary.by_day = by_status, by_day
+        self._versions = {user_id: len(user_index) for user_id, user_index in self._by_user.items()}
+
+    def replay(self, record):
+        if record[0] == "add":
+            self._insert(_payment_from_row(record[1:]))
+        elif record[0] == "status":
+            self._set_status(*record[1:])
+
+
+class _StringColumn:
+    """Variable-length strings packed into one UTF-8 buffer, addressed by row."""
+
+    def __init__(self, nullable: bool = False):
+        self._data = bytearray()
+        self._ends = array("Q")
+        self._nulls = bytearray() if nullable else None
+
+    def append(self, value: Optional[str]):
+        if self._nulls is not None:
+            self._nulls.append(value is None)
+        if value is not None:
+            self._data += value.encode()
+        self._ends.append(len(self._data))
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        if self._nulls is not None and self._nulls[row]:
+            return None
+        start = self._ends[row - 1] if row else 0
+        return self._data[start:self._ends[row]].decode()
+
+    @property
+    def nbytes(self) -> int:
+        nulls = len(self._nulls) if self._nulls is not None else 0
+        return len(self._data) + self._ends.itemsize * len(self._ends) + nulls
+
+    def values(self) -> List[Optional[str]]:
+        """Every row's string, decoded in one pass when the column is ASCII."""
+        text = self._data.decode()
+        starts = array("Q", [0])
+        starts.extend(self._ends[:-1])
+        if len(text) == len(self._data):
+            values = [text[start:end] for start, end in zip(starts, self._ends)]
+        else:
+            data = self._data
+            values = [data[start:end].decode() for start, end in zip(starts, self._ends)]
+        if self._nulls is not None:
+            values = [None if null else value for value, null in zip(values, self._nulls)]
+        return values
+
+    def snapshot(self, name: str) -> dict:
+        sections = {f"{name}.data": bytes(self._data), f"{name}.ends": self._ends[:]}
+        if self._nulls is not None:
+            sections[f"{name}.nulls"] = bytes(self._nulls)
+        return sections
+
+    def restore(self, name: str, sections: dict):
+        self._data = sections[f"{name}.data"]
+        self._ends = sections[f"{name}.ends"]
+        if self._nulls is not None:
+            self._nulls = sections[f"{name}.nulls"]
+
+
+class ColumnarPaymentRepository(PaymentRepository):
+    """
+    Payments stored column-wise in typed arrays instead of one dict each.
+
+    Ids are 16-byte UUIDs, user ids and statuses are small integer codes
+    into interned tables, amounts are integer cents and timestamps are
+    epoch microseconds. Strings share one buffer per column. Each user's
+    index, and the global time index, hold row numbers ordered by
+    (timestamp, payment_id); an id index holds them ordered by payment_id.
+    Records are rebuilt as dicts only when they are read. Amounts are kept
+    to the cent.
+    """
+
+    def __init__(self):
+        self._ids = bytearray()
+        self._users = array("I")
+        self._amounts = array("q")
+        self._statuses = array("B")
+        self._timestamps = array("q")
+        self._expiry_months = array("B")
+        self._expiry_years = array("H")
+        self._card_numbers = _StringColumn()
+        self._card_holders = _StringColumn(nullable=True)
+        self._cvvs = _StringColumn(nullable=True)
+        self._descriptions = _StringColumn(nullable=True)
+        self._user_codes = {}
+        self._user_ids = []
+        self._status_codes = {}
+        self._status_names = []
+        self._by_user = {}
+        self._by_time = _SortedIndex(key=self._key, typecode="q")
+        self._by_id = _SortedIndex(key=self._id, typecode="q")
+        self._summaries = {}
+        self._versions = array("Q")  # by user code
+        self._lock = threading.Lock()
+        self.journal = None
+
+    def add(self, payment):
+        self.add_many([payment])
+
+    def add_many(self, payments):
+        with self._lock:
+            journal = self.journal
+            records = []
+            for payment in payments:
+                self._insert(payment)
+                if journal is not None:
+                    records.append(("add", *_payment_to_row(payment)))
+            if records:
+                journal.append_many(records)
+
+    def _insert(self, payment):
+        row = len(self._timestamps)
+        user_code = self._user_codes.get(payment["user_id"])
+        if user_code is None:
+            user_code = self._user_codes[payment["user_id"]] = len(self._user_ids)
+            self._user_ids.append(payment["user_id"])
+            self._versions.append(0)
+        status_code = self._status_code(payment["status"])
+
+        cents = round(payment["amount"] * 100)
+        self._ids += uuid.UUID(payment["payment_id"]).bytes
+        self._users.append(user_code)
+        self._amounts.append(cents)
+        self._statuses.append(status_code)
+        self._timestamps.append(to_micros(payment["timestamp"]))
+        self._expiry_months.append(payment["expiry_month"])
+        self._expiry_years.append(payment["expiry_year"])
+        self._card_numbers.append(payment["full_card_number"])
+        self._card_holders.append(payment["card_holder"])
+        self._cvvs.append(payment["cvv"])
+        self._descriptions.append(payment["description"])
+
+        user_rows = self._by_user.setdefault(user_code, array("q"))
+        key = self._key(row)
+        if not user_rows or self._key(user_rows[-1]) < key:
+            user_rows.append(row)
+        else:
+            user_rows.insert(self._bisect(user_rows, key), row)
+        self._by_time.add(row)
+        self._by_id.add(row)
+        self._summaries.setdefault(user_code, _PaymentSummary()).add(
+            payment["status"], payment["timestamp"].date().isoformat(), cents)
+        self._versions[user_code] += 1
+
+    def _status_code(self, status: str) -> int:
+        code = self._status_codes.get(status)
+        if code is None:
+            code = self._status_codes[status] = len(self._status_names)
+            self._status_names.append(status)
+        return code
+
+    def _id(self, row: int) -> bytes:
+        return bytes(self._ids[16 * row:16 * row + 16])
+
+    def _key(self, row: int) -> tuple:
+        return self._timestamps[row], self._id(row)
+
+    def _row(self, payment_id: str) -> Optional[int]:
+        try:
+            id_bytes = uuid.UUID(payment_id).bytes
+        except ValueError:
+            return None
+        rows = self._by_id.slice(1, id_bytes)
+        return rows[0] if rows and self._id(rows[0]) == id_bytes else None
+
+    def _bisect(self, rows, key) -> int:
+        """bisect_right over rows, comparing each row's (timestamp, id) key."""
+        lo, hi = 0, len(rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._key(rows[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _record(self, row: int) -> dict:
+        card_number = self._card_numbers[row]
+        return {
+            "payment_id": str(uuid.UUID(bytes=self._id(row))),
+            "user_id": self._user_ids[self._users[row]],
+            "full_card_number": card_number,
+            "card_last_four": card_number[-4:],
+            "card_holder": self._card_holders[row],
+            "expiry_month": self._expiry_months[row],
+            "expiry_year": self._expiry_years[row],
+            "cvv": self._cvvs[row],
+            "amount": self._amounts[row] / 100,
+            "status": self._status_names[self._statuses[row]],
+            "timestamp": from_micros(self._timestamps[row]),
+            "description": self._descriptions[row]
+        }
+
+    @staticmethod
+    def _index_key(key: Optional[Tuple[datetime, str]]) -> Optional[tuple]:
+        if key is None:
+            return None
+        timestamp, payment_id = key
+        return to_micros(timestamp), uuid.UUID(payment_id).bytes
+
+    def get(self, payment_id):
+        with self._lock:
+            row = self._row(payment_id)
+            return None if row is None else self._record(row)
+
+    def update_statuses(self, updates):
+        with self._lock:
+            changed = [update for update in updates if self._set_status(*update)]
+            if changed and self.journal is not None:
+                self.journal.append_many([("status", *update) for update in changed])
+            return len(changed)
+
+    def _set_status(self, payment_id: str, status: str) -> bool:
+        row = self._row(payment_id)
+        if row is None:
+            return False
+        old_status = self._status_names[self._statuses[row]]
+        if old_status == status:
+            return False
+        self._statuses[row] = self._status_code(status)
+        self._summaries[self._users[row]].move(old_status, status, self._amounts[row])
+        self._versions[self._users[row]] += 1
+        return True
+
+    def list_for_user(self, user_id, limit, after=None, since=None, until=None):
+        with self._lock:
+            user_rows = self._by_user.get(self._user_codes.get(user_id), ())
+            start = self._bisect(user_rows, self._index_key(after)) if after else 0
+            if since:
+                # (micros,) sorts before every key at that timestamp
+                start = max(start, self._bisect(user_rows, (to_micros(since),)))
+            end = self._bisect(user_rows, (to_micros(until),)) if until else len(user_rows)
+            return [self._record(row) for row in user_rows[start:min(start + limit, end)]]
+
+    def list_range(self, limit, since=None, until=None, after=None):
+        low, inclusive = _range_start((to_micros(since),) if since else None,
+                                      self._index_key(after))
+        with self._lock:
+            rows = self._by_time.slice(limit, low, (to_micros(until),) if until else None,
+                                       inclusive)
+            return [self._record(row) for row in rows]
+
+    def iter_all(self):
+        # Rows are append-only, so rows below the current count never change
+        for row in range(len(self._timestamps)):
+            yield self._record(row)
+
+    def summary(self, user_id):
+        with self._lock:
+            summary = self._summaries.get(self._user_codes.get(user_id))
+            return summary.as_dict() if summary else empty_summary()
+
+    def version(self, user_id):
+        user_code = self._user_codes.get(user_id)
+        return 0 if user_code is None else self._versions[user_code]
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def iter_by_time(self) -> Iterator[dict]:
+        """
+        Every payment in (timestamp, payment_id) order. Whole columns are
+        decoded up front, so this suits bulk loads rather than short reads.
+        """
+        rows, _ = self._by_time.export()
+        hex_ids = self._ids.hex()
+        columns = [
+            [f"{hex_ids[i:i + 8]}-{hex_ids[i + 8:i + 12]}-{hex_ids[i + 12:i + 16]}-"
+             f"{hex_ids[i + 16:i + 20]}-{hex_ids[i + 20:i + 32]}"
+             for i in range(0, len(hex_ids), 32)],
+            [self._user_ids[code] for code in self._users],
+            self._card_numbers.values(),
+            self._card_holders.values(),
+            self._expiry_months,
+            self._expiry_years,
+            self._cvvs.values(),
+            [cents / 100 for cents in self._amounts],
+            [self._status_names[code] for code in self._statuses],
+            [_EPOCH + timedelta(microseconds=micros) for micros in self._timestamps],
+            self._descriptions.values()
+        ]
+        if rows != array("q", range(len(rows))):
+            columns = [[column[row] for row in rows] for column in columns]
+        for (payment_id, user_id, card_number, card_holder, expiry_month, expiry_year, cvv,
+             amount, status, timestamp, description) in zip(*columns):
+            yield {
+                "payment_id": payment_id,
+                "user_id": user_id,
+                "full_card_number": card_number,
+                "card_last_four": card_number[-4:],
+                "card_holder": card_holder,
+                "expiry_month": expiry_month,
+                "expiry_year": expiry_year,
+                "cvv": cvv,
+                "amount": amount,
+                "status": status,
+                "timestamp": timestamp,
+                "description": description
+            }
+
+    # Typed arrays copied into snapshots as they are, by attribute name
+    _ARRAY_COLUMNS = ("_users", "_amounts", "_statuses", "_timestamps",
+                      "_expiry_months", "_expiry_years")
+    _STRING_COLUMNS = ("_card_numbers", "_card_holders", "_cvvs", "_descriptions")
+
+    def snapshot(self, rotate):
+        # Only whole arrays are copied under the lock (one C-level copy each,
+        # plus one per index block); the per-user index and summaries are
+        # rebuilt from those copies afterwards, as the live ones keep changing
+        with self._lock:
+            rotate()
+            sections = {"ids": bytes(self._ids), "user_ids": list(self._user_ids),
+                        "status_names": list(self._status_names)}
+            for name in self._ARRAY_COLUMNS:
+                sections[name[1:]] = getattr(self, name)[:]
+            for name in self._STRING_COLUMNS:
+                sections.update(getattr(self, name).snapshot(name[1:]))
+            sections["by_time"], sections["by_time_lengths"] = self._by_time.export()
+            sections["by_id"], sections["by_id_lengths"] = self._by_id.export()
+        sections.update(self._user_sections(sections))
+        return sections
+
+    @staticmethod
+    def _user_sections(sections: dict) -> dict:
+        """The by_user index and summaries sections, computed from a snapshot's columns."""
+        users, amounts = sections["users"], sections["amounts"]
+        # A stable sort keeps each user's rows in (timestamp, payment_id) order
+        by_user = array("q", sorted(sections["by_time"], key=users.__getitem__))
+        summaries = [_PaymentSummary() for _ in sections["user_ids"]]
+        day_numbers = [micros // _DAY_MICROS for micros in sections["timestamps"]]
+        day_names = {day: (_EPOCH + timedelta(days=day)).date().isoformat()
+                     for day in set(day_numbers)}
+        for keys, field, name in ((zip(users, sections["statuses"]), "by_status",
+                                   sections["status_names"].__getitem__),
+                                  (zip(users, day_numbers), "by_day", day_names.__getitem__)):
+            keys = list(keys)
+            counts = Counter(keys)
+            cents = dict.fromkeys(counts, 0)
+            for key, amount in zip(keys, amounts):
+                cents[key] += amount
+            for (code, value), count in counts.items():
+                getattr(summaries[code], field)[name(value)] = [count, cents[code, value]]
+        for code, count in Counter(users).items():
+            summaries[code].count = count
+        for code, amount in zip(users, amounts):
+            summaries[code].cents += amount
+        return {
+            "by_user": by_user,
+            "by_user_lengths": array("Q", (summary.count for summary in summaries)),
+            "summaries": [(code, summary.count, summary.cents, summary.by_status, summary.by_day)
+                          for code, summary in enumerate(summaries)]
+        }
+
+    def restore(self, sections):
+        self._ids = sections["ids"]
+        self._user_ids = sections["user_ids"]
+        self._user_codes = {user_id: code for code, user_id in enumerate(self._user_ids)}
+        self._status_names = sections["status_names"]
+        self._status_codes = {name: code for code, name in enumerate(self._status_names)}
+        # Versions only need to differ within a process, so they restart at zero
+        self._versions = array("Q", bytes(8 * len(self._user_ids)))
+        for name in self._ARRAY_COLUMNS:
+            setattr(self, name, sections[name[1:]])
+        for name in self._STRING_COLUMNS:
+            getattr(self, name).restore(name[1:], sections)
+        by_user, start = sections["by_user"], 0
+        for code, length in enumerate(sections["by_user_lengths"]):
+            self._by_user[code] = by_user[start:start + length]
+            start += length
+        self._by_time.load(sections["by_time"], sections["by_time_lengths"])
+        if "by_id" in sections:
+            self._by_id.load(sections["by_id"], sections["by_id_lengths"])
+        else:
+            # Written before payments were indexed by id
+            self._by_id.load(array("q", sorted(range(len(self._timestamps)), key=self._id)))
+        for code, count, cents, by_status, by_day in sections["summaries"]:
+            summary = self._summaries[code] = _PaymentSummary()
+            summary.count, summary.cents = count, cents
+            summary.by_status, summary.by_day = by_status, by_day
+
+    def replay(self, record):
+        if record[0] == "add":
+            self._insert(_payment_from_row(record[1:]))
+        elif record[0] == "status":
+            self._set_status(*record[1:])
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the column buffers and per-user indexes."""
+        arrays = [self._users, self._amounts, self._statuses, self._timestamps,
+                  self._expiry_months, self._expiry_years, *self._by_user.values()]
+        strings = [self._card_numbers, self._card_holders, self._cvvs, self._descriptions]
+        return (len(self._ids) + sum(a.itemsize * len(a) for a in arrays)
+                + sum(column.nbytes for column in strings) + self._by_time.nbytes
+                + self._by_id.nbytes)
+
+
+def create_memory_storage(token_ttl_seconds: int, max_tokens_per_user: Optional[int] = None,
+                          max_tokens: Optional[int] = None,
+                          payment_store: str = "dict") -> Storage:
+    if payment_store == "dict":
+        payments = MemoryPaymentRepository()
+    elif payment_store == "columnar":
+        payments = ColumnarPaymentRepository()
+    else:
+        raise ValueError(f"Unknown payment store: {payment_store!r}")
+    return Storage(
+        users=MemoryUserRepository(),
+        tokens=MemoryTokenRepository(token_ttl_seconds, max_tokens_per_user, max_tokens),
+        revoked_tokens=MemoryTokenRepository(token_ttl_seconds, max_size=max_tokens),
+        payments=payments,
+    )
+
+
+# --- SQLite backend ---
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    hashed_password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tokens_username ON tokens (username, expires_at);
+CREATE INDEX IF NOT EXISTS tokens_expires_at ON tokens (expires_at);
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    token TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revoked_tokens_username ON revoked_tokens (username, expires_at);
+CREATE INDEX IF NOT EXISTS revoked_tokens_expires_at ON revoked_tokens (expires_at);
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    full_card_number TEXT NOT NULL,
+    card_last_four TEXT NOT NULL,
+    card_holder TEXT,
+    expiry_month INTEGER,
+    expiry_year INTEGER,
+    cvv TEXT,
+    amount REAL NOT NULL,
+    status TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS payments_user_timestamp ON payments (user_id, timestamp, payment_id);
+DROP INDEX IF EXISTS payments_timestamp;
+CREATE INDEX IF NOT EXISTS payments_timestamp_id ON payments (timestamp, payment_id);
+CREATE TABLE IF NOT EXISTS payment_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS payment_summaries (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL,
+    PRIMARY KEY (user_id, kind, key)
+) WITHOUT ROWID;
+"""
+
+# Rebuilds payment_summaries for a database created before it existed
+BACKFILL_SUMMARIES = """
+INSERT INTO payment_summaries (user_id, kind, key, count, total_cents)
+SELECT user_id, 'status', status, COUNT(*), SUM(CAST(ROUND(amount * 100) AS INTEGER))
+FROM payments GROUP BY user_id, status;
+INSERT INTO payment_summaries (user_id, kind, key, count, total_cents)
+SELECT user_id, 'day', date(timestamp / 1000000, 'unixepoch'), COUNT(*),
+       SUM(CAST(ROUND(amount * 100) AS INTEGER))
+FROM payments GROUP BY user_id, date(timestamp / 1000000, 'unixepoch');
+"""
+
+# Statements are constant strings so each pooled connection compiles them
+# once and reuses them from its statement cache
+INSERT_USER = ("INSERT INTO users (username, user_id, email, hashed_password) "
+               "VALUES (?, ?, ?, ?) ON CONFLICT (username) DO NOTHING")
+SELECT_USER = "SELECT username, user_id, email, hashed_password FROM users WHERE username = ?"
+SELECT_FIRST_USER = "SELECT username, user_id, email, hashed_password FROM users LIMIT 1"
+UPDATE_PASSWORD = "UPDATE users SET hashed_password = ? WHERE username = ?"
+COUNT_USERS = "SELECT COUNT(*) FROM users"
+INSERT_PAYMENT = (f"INSERT INTO payments ({', '.join(PAYMENT_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(PAYMENT_COLUMNS))})")
+SELECT_PAYMENTS = f"SELECT {', '.join(PAYMENT_COLUMNS)} FROM payments"
+SELECT_PAYMENT = SELECT_PAYMENTS + " WHERE payment_id = ?"
+SELECT_PAYMENT_STATUS = "SELECT user_id, status, amount FROM payments WHERE payment_id = ?"
+UPDATE_PAYMENT_STATUS = "UPDATE payments SET status = ? WHERE payment_id = ?"
+PAYMENT_ORDER = " ORDER BY timestamp, payment_id LIMIT ?"
+COUNT_PAYMENTS = "SELECT COUNT(*) FROM payments"
+UPSERT_SUMMARY = ("INSERT INTO payment_summaries (user_id, kind, key, count, total_cents) "
+                  "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, kind, key) DO UPDATE SET "
+                  "count = count + excluded.count, total_cents = total_cents + excluded.total_cents")
+SELECT_SUMMARY = "SELECT kind, key, count, total_cents FROM payment_summaries WHERE user_id = ?"
+BUMP_VERSION = ("INSERT INTO payment_versions (user_id, version) VALUES (?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET version = version + 1")
+SELECT_VERSION = "SELECT version FROM payment_versions WHERE user_id = ?"
+DELETE_EMPTY_SUMMARY = ("DELETE FROM payment_summaries "
+                        "WHERE user_id = ? AND kind = ? AND key = ? AND count = 0")
+
+
+class SQLiteConnectionPool:
+    """A fixed set of connections to one WAL-mode database file."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self._connections = queue.LifoQueue()
+        for _ in range(size):
+            self._connections.put(self._connect())
+        with self.connection() as conn:
+            has_summaries = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'payment_summaries'").fetchone()
+            conn.executescript(SCHEMA)
+            if not has_summaries:
+                conn.executescript(BACKFILL_SUMMARIES)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get().close()
+
+
+def _user_from_row(row) -> Optional[dict]:
+    if row is None:
+        return None
+    username, user_id, email, hashed_password = row
+    return {"email": email, "username": username,
+            "hashed_password": hashed_password, "user_id": user_id}
+
+
+class SQLiteUserRepository(UserRepository):
+
+    def __init__(self, pool: SQLiteConnectionPool):
+        self._pool = pool
+
+    def get(self, username):
+        with self._pool.connection() as conn:
+            return _user_from_row(conn.execute(SELECT_USER, (username,)).fetchone())
+
+    def add(self, user):
+        return self.add_many([user])[0]
+
+    def add_many(self, users):
+        with self._pool.transaction() as conn:
+            return [
+                conn.execute(INSERT_USER, (user["username"], user["user_id"], user["email"],
+                                           user["hashed_password"])).rowcount == 1
+                for user in users
+            ]
+
+    def update_password(self, username, hashed_password):
+        with self._pool.connection() as conn:
+            conn.execute(UPDATE_PASSWORD, (hashed_password, username))
+
+    def first(self):
+        with self._pool.connection() as conn:
+            return _user_from_row(conn.execute(SELECT_FIRST_USER).fetchone())
+
+    def __len__(self):
+        with self._pool.connection() as conn:
+            return conn.execute(COUNT_USERS).fetchone()[0]
+
+
+class SQLiteTokenRepository(TokenRepository):
+    """Tokens in a table with a TTL and a per-user cap; see MemoryTokenRepository."""
+
+    def __init__(self, pool: SQLiteConnectionPool, table: str, ttl_seconds: int,
+                 max_per_user: Optional[int] = None):
+        self._pool = pool
+        self.ttl_seconds = ttl_seconds
+        self.max_per_user = max_per_user
+        self._insert = f"INSERT OR REPLACE INTO {table} (token, username, expires_at) VALUES (?, ?, ?)"
+        self._select = f"SELECT username, expires_at FROM {table} WHERE token = ?"
+        self._delete = f"DELETE FROM {table} WHERE token = ?"
+        self._evict_user = (f"DELETE FROM {table} WHERE token IN (SELECT token FROM {table} "
+                            "WHERE username = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)")
+        self._sweep = (f"DELETE FROM {table} WHERE token IN (SELECT token FROM {table} "
+                       "WHERE expires_at <= ? LIMIT ?)")
+        self._count = f"SELECT COUNT(*) FROM {table}"
+        # Counters are per process; the table itself is shared
+        self.expired_evictions = 0
+        self.cap_evictions = 0
+        self.revocations = 0
+
+    def issue(self, token, username, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._pool.transaction() as conn:
+            if self.max_per_user is not None:
+                evicted = conn.execute(self._evict_user, (username, self.max_per_user - 1))
+                self.cap_evictions += evicted.rowcount
+            conn.execute(self._insert, (token, username, time.time() + ttl))
+
+    def get(self, token):
+        with self._pool.connection() as conn:
+            row = conn.execute(self._select, (token,)).fetchone()
+            if row is None:
+                return None
+            username, expires_at = row
+            if expires_at <= time.time():
+                conn.execute(self._delete, (token,))
+                self.expired_evictions += 1
+                return None
+            return username
+
+    def revoke(self, token):
+        with self._pool.connection() as conn:
+            revoked = conn.execute(self._delete, (token,)).rowcount == 1
+        self.revocations += revoked
+        return revoked
+
+    def sweep(self, max_items):
+        with self._pool.connection() as conn:
+            removed = conn.execute(self._sweep, (time.time(), max_items)).rowcount
+        self.expired_evictions += removed
+        return removed
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "expired_evictions": self.expired_evictions,
+            "cap_evictions": self.cap_evictions,
+            "revocations": self.revocations
+        }
+
+    def __len__(self):
+        with self._pool.connection() as conn:
+            return conn.execute(self._count).fetchone()[0]
+
+
+class SQLitePaymentRepository(PaymentRepository):
+
+    def __init__(self, pool: SQLiteConnectionPool):
+        self._pool = pool
+
+    def add(self, payment):
+        self.add_many([payment])
+
+    def add_many(self, payments):
+        payments = list(payments)
+        # Fold the batch into one summary delta per (user, kind, key)
+        deltas = {}
+        for payment in payments:
+            cents = round(payment["amount"] * 100)
+            for kind, key in (("status", payment["status"]),
+                              ("day", payment["timestamp"].date().isoformat())):
+                totals = deltas.setdefault((payment["user_id"], kind, key), [0, 0])
+                totals[0] += 1
+                totals[1] += cents
+        with self._pool.transaction() as conn:
+            conn.executemany(INSERT_PAYMENT, map(_payment_to_row, payments))
+            conn.executemany(UPSERT_SUMMARY, [(*key, count, cents)
+                                              for key, (count, cents) in deltas.items()])
+            conn.executemany(BUMP_VERSION, {(payment["user_id"],) for payment in payments})
+
+    def get(self, payment_id):
+        with self._pool.connection() as conn:
+            row = conn.execute(SELECT_PAYMENT, (payment_id,)).fetchone()
+        return None if row is None else _payment_from_row(row)
+
+    def update_statuses(self, updates):
+        deltas = {}
+        changed = 0
+        with self._pool.transaction() as conn:
+            for payment_id, status in updates:
+                row = conn.execute(SELECT_PAYMENT_STATUS, (payment_id,)).fetchone()
+                if row is None or row[1] == status:
+                    continue
+                user_id, old_status, amount = row
+                conn.execute(UPDATE_PAYMENT_STATUS, (status, payment_id))
+                cents = round(amount * 100)
+                for key, sign in ((old_status, -1), (status, 1)):
+                    totals = deltas.setdefault((user_id, "status", key), [0, 0])
+                    totals[0] += sign
+                    totals[1] += sign * cents
+                changed += 1
+            conn.executemany(UPSERT_SUMMARY, [(*key, count, cents)
+                                              for key, (count, cents) in deltas.items()])
+            conn.executemany(DELETE_EMPTY_SUMMARY, list(deltas))
+            conn.executemany(BUMP_VERSION, {(user_id,) for user_id, _, _ in deltas})
+        return changed
+
+    def list_for_user(self, user_id, limit, after=None, since=None, until=None):
+        # Served from payments_user_timestamp
+        return self._select(["user_id = ?"], [user_id], limit, after, since, until)
+
+    def list_range(self, limit, since=None, until=None, after=None):
+        # Served from payments_timestamp_id
+        return self._select([], [], limit, after, since, until)
+
+    def _select(self, conditions: list, params: list, limit: int, after, since, until) -> List[dict]:
+        # Only a handful of distinct statements result, so each stays cached
+        if after is not None:
+            conditions.append("(timestamp, payment_id) > (?, ?)")
+            params += [to_micros(after[0]), after[1]]
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(to_micros(since))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(to_micros(until))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._pool.connection() as conn:
+            rows = conn.execute(SELECT_PAYMENTS + where + PAYMENT_ORDER, (*params, limit))
+            return [_payment_from_row(row) for row in rows]
+
+    def iter_all(self):
+        with self._pool.connection() as conn:
+            for row in conn.execute(SELECT_PAYMENTS):
+                yield _payment_from_row(row)
+
+    def summary(self, user_id):
+        with self._pool.connection() as conn:
+            rows = conn.execute(SELECT_SUMMARY, (user_id,)).fetchall()
+        summary = empty_summary()
+        for kind, key, count, cents in sorted(rows):
+            summary["by_" + kind][key] = {"count": count, "total": cents / 100}
+            if kind == "status":
+                summary["count"] += count
+                summary["total"] += cents
+        summary["total"] /= 100
+        return summary
+
+    def version(self, user_id):
+        with self._pool.connection() as conn:
+            row = conn.execute(SELECT_VERSION, (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def __len__(self):
+        with self._pool.connection() as conn:
+            return conn.execute(COUNT_PAYMENTS).fetchone()[0]
+
+
+def create_sqlite_storage(path: str, pool_size: int, token_ttl_seconds: int,
+                          max_tokens_per_user: Optional[int] = None) -> Storage:
+    pool = SQLiteConnectionPool(path, pool_size)
+    return Storage(
+        users=SQLiteUserRepository(pool),
+        tokens=SQLiteTokenRepository(pool, "tokens", token_ttl_seconds, max_tokens_per_user),
+        revoked_tokens=SQLiteTokenRepository(pool, "revoked_tokens", token_ttl_seconds),
+        payments=SQLitePaymentRepository(pool),
+        close=pool.close,
+    )
+
+
+def create_storage(backend: str, token_ttl_seconds: int,
+                   max_tokens_per_user: Optional[int] = None, max_tokens: Optional[int] = None,
+                   payment_store: str = "dict", sqlite_path: str = "api.db",
+                   sqlite_pool_size: int = 8) -> Storage:
+    """
+    Build the storage backend named by backend ("memory" or "sqlite").
+    payment_store picks the memory backend's payment layout ("dict" or
+    "columnar").
+    """
+    if backend == "memory":
+        return create_memory_storage(token_ttl_seconds, max_tokens_per_user, max_tokens,
+                                     payment_store)
+    if backend == "sqlite":
+        return create_sqlite_storage(sqlite_path, sqlite_pool_size, token_ttl_seconds,
+                                     max_tokens_per_user)
+    raise ValueError(f"Unknown storage backend: {backend!r}")
@@ -0,0 +1,38 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+ADMIN_HEADERS = {"X-Admin-Password": main.ADMIN_PASSWORD}
+
+
+def import_body(username: str) -> bytes:
+    row = {"email": f"{username}@example.com", "username": username, "password": "Passw0rdX"}
+    return json.dumps(row).encode() + b"\n"
+
+
+def test_import_users_requires_admin_password():
+    for headers in ({}, {"X-Admin-Password": "wrong"}):
+        response = client.post("/admin/import-users", content=import_body("import_denied"),
+                               headers=headers)
+        assert response.status_code == 401
+    assert "import_denied" not in main.users_db
+
+
+def test_import_users_with_admin_password():
+    response = client.post("/admin/import-users", content=import_body("import_allowed"),
+                           headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[-1] == {"summary": {"rows": 1, "imported": 1, "failed": 0}}
+    assert "import_allowed" in main.users_db
+
+
+def test_command_job_routes_require_admin_password():
+    for path in ("/admin/command-jobs/unknown", "/admin/command-jobs/unknown/output"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"X-Admin-Password": "wrong"}).status_code == 401
+        assert client.get(path, headers=ADMIN_HEADERS).status_code == 404
@@ -0,0 +1,90 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+import persistence
+from persistence import Persistence
+from storage import create_storage
+
+
+def new_storage(payment_store: str = "dict"):
+    return create_storage("memory", token_ttl_seconds=3600, payment_store=payment_store)
+
+
+def new_payment(amount: float) -> dict:
+    return {
+        "payment_id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "full_card_number": "4111111111111111",
+        "card_last_four": "1111",
+        "card_holder": "Test Holder",
+        "expiry_month": 12,
+        "expiry_year": 2030,
+        "cvv": "123",
+        "amount": amount,
+        "status": "completed",
+        "timestamp": datetime(2024, 1, 1, 12, 30, 15, 123456),
+        "description": "Round trip"
+    }
+
+
+def restart(directory, payment_store: str = "dict"):
+    storage = new_storage(payment_store)
+    persistence = Persistence(storage, str(directory))
+    persistence.load()
+    return storage
+
+
+def test_snapshot_keeps_sub_cent_amounts(tmp_path):
+    storage = new_storage()
+    persistence = Persistence(storage, str(tmp_path))
+    persistence.open()
+    payments = [new_payment(10.555), new_payment(0.001), new_payment(42.0)]
+    storage.payments.add_many(payments)
+    persistence.snapshot()
+    persistence.close()
+
+    restored = restart(tmp_path)
+    for payment in payments:
+        assert restored.payments.get(payment["payment_id"]) == payment
+
+
+def test_journal_keeps_sub_cent_amounts(tmp_path):
+    storage = new_storage()
+    persistence = Persistence(storage, str(tmp_path))
+    persistence.open()
+    payment = new_payment(10.555)
+    storage.payments.add(payment)
+    persistence.close()
+
+    restored = restart(tmp_path)
+    assert restored.payments.get(payment["payment_id"]) == payment
+
+
+@pytest.mark.parametrize("payment_store", ["dict", "columnar"])
+def test_snapshot_leaves_out_writes_made_while_it_is_written(tmp_path, monkeypatch, payment_store):
+    storage = new_storage(payment_store)
+    durable = Persistence(storage, str(tmp_path))
+    durable.open()
+    first = new_payment(10.0)
+    second = dict(new_payment(5.0), user_id=first["user_id"])
+    storage.payments.add(first)
+    write_snapshot = persistence.write_snapshot
+
+    def write_after_changes(path, sections):
+        # Journaled in the next segment, so the snapshot must not count them
+        storage.payments.add(second)
+        storage.payments.update_statuses([(first["payment_id"], "failed")])
+        write_snapshot(path, sections)
+
+    monkeypatch.setattr(persistence, "write_snapshot", write_after_changes)
+    durable.snapshot()
+    durable.close()
+
+    restored = restart(tmp_path, payment_store)
+    summary = restored.payments.summary(first["user_id"])
+    assert summary == storage.payments.summary(first["user_id"])
+    assert summary["count"] == 2
+    assert summary["by_status"] == {"failed": {"count": 1, "total": 10.0},
+                                    "completed": {"count": 1, "total": 5.0}}